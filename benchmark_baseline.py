@@ -0,0 +1,41 @@
+import json
+import sys
+
+
+def compare(results, baseline, tolerance, higher_is_better=False):
+    """
+        Returns (stage, baseline, measured) for the stages more than tolerance worse than the baseline.
+        higher_is_better is True for throughputs and False for timings.
+    """
+    regressions = []
+    for stage, expected in baseline.items():
+        if stage not in results:
+            continue
+        if higher_is_better:
+            worse = results[stage] < expected * (1 - tolerance)
+        else:
+            worse = results[stage] > expected * (1 + tolerance)
+        if worse:
+            regressions.append((stage, expected, results[stage]))
+    return regressions
+
+
+def check_baseline(results, save_path=None, baseline_path=None, tolerance=0.2, higher_is_better=False, unit=''):
+    """
+        Saves the results as a baseline JSON and/or compares them with one,
+        exits with status 1 when a stage regressed beyond tolerance
+    """
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {save_path}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, tolerance, higher_is_better)
+        for stage, expected, measured in regressions:
+            print(f"REGRESSION {stage}: {measured:.4g}{unit}, baseline {expected:.4g}{unit}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {tolerance:.0%} against {baseline_path}")
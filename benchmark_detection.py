@@ -0,0 +1,81 @@
+import argparse
+import time
+import cv2
+import dlib
+
+from face_detection import Face
+
+
+def sample_frames(video_path, max_frames=200, step=5):
+    """
+        Returns every step-th grayscale frame of the video, at most max_frames of them
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video {video_path}.")
+
+    frames = []
+    frame_num = 0
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if frame_num % step == 0:
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        frame_num += 1
+    cap.release()
+    return frames
+
+
+def overlap(a, b):
+    """
+        Intersection over union of two dlib rectangles
+    """
+    inside_w = min(a.right(), b.right()) - max(a.left(), b.left())
+    inside_h = min(a.bottom(), b.bottom()) - max(a.top(), b.top())
+    if inside_w <= 0 or inside_h <= 0:
+        return 0.0
+    inside = inside_w * inside_h
+    return inside / (a.width() * a.height() + b.width() * b.height() - inside)
+
+
+def benchmark_scale(detector, frames, scale, reference):
+    """
+        Times the detector on the frames resized by scale (resize included).
+        Returns ms per frame, the miss rate and the mean overlap with the full resolution boxes.
+    """
+    misses, overlaps = 0, []
+    start = time.perf_counter()
+    for gray, expected in zip(frames, reference):
+        small = gray if scale == 1 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        faces = detector(small, 0)
+        if len(faces) == 0:
+            misses += 1
+        elif expected is not None:
+            overlaps.append(overlap(Face._scale_rect(faces[0], 1 / scale, gray.shape), expected))
+    elapsed = time.perf_counter() - start
+
+    n = max(len(frames), 1)
+    return elapsed / n * 1000, misses / n, sum(overlaps) / len(overlaps) if overlaps else float('nan')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark face detection time and miss rate at several detection scales")
+    parser.add_argument("videos", nargs="+", help="Recorded videos to sample frames from")
+    parser.add_argument("-s", "--scales", type=float, nargs="+", default=[1.0, 0.5, 0.35, 0.25], help="Detection scales to compare")
+    parser.add_argument("-n", "--max_frames", type=int, default=200, help="Frames sampled per video")
+    parser.add_argument("--step", type=int, default=5, help="Sample every N-th frame")
+    args = parser.parse_args()
+
+    detector = dlib.get_frontal_face_detector()
+    for video in args.videos:
+        frames = sample_frames(video, args.max_frames, args.step)
+        reference = []
+        for gray in frames:
+            faces = detector(gray, 0)
+            reference.append(faces[0] if len(faces) > 0 else None)
+
+        print(f"{video}: {len(frames)} frames")
+        for scale in args.scales:
+            ms, miss_rate, mean_overlap = benchmark_scale(detector, frames, scale, reference)
+            print(f"  scale {scale:.2f}: {ms:.1f} ms/frame, miss rate {miss_rate:.1%}, overlap with full resolution {mean_overlap:.2f}")
@@ -0,0 +1,148 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from benchmark_baseline import check_baseline
+from data_processing import load_data, split_by_slides, cross_check_mind_wandering
+from log_io import LOG_FORMATS, log_file_name, save_log
+from slide import Slides
+
+STAGES = ('load_data', 'split_by_slides', 'mind_wandering_report', 'cross_check')
+
+
+def synthetic_session(gaze_rows, slides, fps=30.0, seed=0):
+    """
+        Generates the gaze log, blink log and user inputs of a session with gaze_rows gaze samples.
+        Gaze alternates between fixations and saccades, there is about one blink every 4 seconds,
+        slide transitions are spread over the session and about every other slide has a mind wandering report.
+    """
+    rng = np.random.default_rng(seed)
+    slides = min(slides, gaze_rows - 1)
+    duration = gaze_rows / fps
+    times = np.arange(gaze_rows) / fps
+
+    # fixations: the gaze stays around one position until a saccade (about every 10 frames)
+    fixation = np.cumsum(rng.random(gaze_rows) < 0.1)
+    left_x = rng.normal(0, 5, fixation[-1] + 1)[fixation] + rng.normal(0, 0.5, gaze_rows)
+    right_x = left_x + rng.normal(0, 0.5, gaze_rows)
+    gaze_df = pd.DataFrame({
+        'left_eye_x': left_x, 'left_eye_y': rng.normal(0, 2, gaze_rows),
+        'right_eye_x': right_x, 'right_eye_y': rng.normal(0, 2, gaze_rows),
+        'start_time': times, 'end_time': times + 1 / fps,
+        'left_eye_h': np.full(gaze_rows, 31, np.int32), 'left_eye_w': np.full(gaze_rows, 52, np.int32),
+        'right_eye_h': np.full(gaze_rows, 31, np.int32), 'right_eye_w': np.full(gaze_rows, 52, np.int32),
+    })
+
+    blinks = max(int(duration / 4), 10)
+    blink_start = np.sort(rng.uniform(0, duration, blinks))
+    blink_duration = rng.uniform(0.05, 0.5, blinks)
+    blink_df = pd.DataFrame({'start_time': blink_start, 'end_time': blink_start + blink_duration,
+                             'duration': blink_duration})
+
+    # the session ends at the last transition, slide i lasts until transition i
+    transitions = np.sort(rng.choice(np.arange(1, gaze_rows), slides, replace=False)) / fps
+    reports = np.sort(rng.uniform(0, transitions[-1], max(slides // 2, 1)))
+    user_inputs_df = pd.concat([
+        pd.DataFrame({'action': 'slide_transition', 'time': transitions, 'slide': np.arange(slides)}),
+        pd.DataFrame({'action': 'mind_wandering', 'time': reports,
+                      'slide': np.searchsorted(transitions, reports, side='right')}),
+    ]).sort_values('time', kind='stable').reset_index(drop=True)
+    return blink_df, gaze_df, user_inputs_df
+
+
+def measure(function, memory=False, setup=None):
+    """
+        Returns the result, the seconds taken and (with memory) the peak traced memory in MB.
+        Timing and memory tracing are separate runs, tracing slows the code down.
+        setup is called before every run, outside the timing and the tracing.
+    """
+    if setup is not None:
+        setup()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    if not memory:
+        return result, elapsed, None
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / (1 << 20)
+
+
+def benchmark_session(gaze_rows, slides, folder, log_format, memory):
+    blink_df, gaze_df, user_inputs_df = synthetic_session(gaze_rows, slides)
+    blink_path = os.path.join(folder, log_file_name(f"blink_{gaze_rows}", log_format))
+    gaze_path = os.path.join(folder, log_file_name(f"gaze_{gaze_rows}", log_format))
+    inputs_path = os.path.join(folder, f"user_inputs_{gaze_rows}.csv")
+    user_inputs_df.to_csv(inputs_path, index=False)
+
+    def write_raw_logs():
+        # load_data writes the split logs back, so every run starts from the raw logs
+        save_log(blink_df, blink_path)
+        save_log(gaze_df, gaze_path)
+
+    results = {}
+    _, results['load_data'], results['load_data_mb'] = measure(
+        lambda: load_data(blink_path, gaze_path, inputs_path), memory, setup=write_raw_logs)
+    _, results['split_by_slides'], results['split_by_slides_mb'] = measure(
+        lambda: split_by_slides(blink_df, gaze_df, user_inputs_df), memory)
+
+    word_count = [100] * len(user_inputs_df)
+    velocity_threshold = 2.0
+    report, results['mind_wandering_report'], results['mind_wandering_report_mb'] = measure(
+        lambda: Slides(blink_path, gaze_path, inputs_path, word_count, velocity_threshold).mind_wandering_report(), memory)
+    _, results['cross_check'], results['cross_check_mb'] = measure(
+        lambda: cross_check_mind_wandering(user_inputs_df, report), memory)
+    return {key: value for key, value in results.items() if value is not None}
+
+
+def scaling_slope(rows, seconds):
+    """
+        Slope of log(time) over log(rows): about 1 for linear stages, clearly above 1 for super-linear ones
+    """
+    rows, seconds = np.asarray(rows, dtype=float), np.asarray(seconds, dtype=float)
+    usable = seconds > 0
+    if usable.sum() < 2:
+        return float('nan')
+    return np.polyfit(np.log(rows[usable]), np.log(seconds[usable]), 1)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the post-processing stages on synthetic session logs of growing size")
+    parser.add_argument("-r", "--rows", type=int, nargs="+", default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7], help="Gaze log sizes")
+    parser.add_argument("-s", "--slides", type=int, default=200, help="Slides per session")
+    parser.add_argument("-lf", "--log_format", type=str, default="npz", choices=LOG_FORMATS, help="File format of the generated logs")
+    parser.add_argument("-m", "--memory", action="store_true", help="Also record the peak traced memory of every stage")
+    parser.add_argument("-o", "--output", type=str, help="Save the results as CSV")
+    parser.add_argument("-b", "--baseline", type=str, help="Baseline JSON to compare against")
+    parser.add_argument("--save_baseline", type=str, help="Save the results as a baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for gaze_rows in sorted(args.rows):
+            print(f"Benchmarking {gaze_rows} gaze rows...")
+            rows.append({'rows': gaze_rows, **benchmark_session(gaze_rows, args.slides, folder, args.log_format, args.memory)})
+    results = pd.DataFrame(rows)
+
+    pd.set_option('display.width', 200)
+    print(results.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+    print("Scaling (slope of log time over log rows, 1 = linear):")
+    for stage in STAGES:
+        slope = scaling_slope(results['rows'], results[stage])
+        print(f"  {stage:24s} {slope:5.2f}{'  super-linear' if slope > 1.15 else ''}")
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+    timings = {f"{stage}@{row['rows']}": row[stage] for row in rows for stage in STAGES}
+    check_baseline(timings, args.save_baseline, args.baseline, args.tolerance, unit='s')
@@ -0,0 +1,85 @@
+import argparse
+import time
+import cv2
+import numpy as np
+
+from face_detection import Face
+from pupil import Pupil
+
+
+def record_eye_crops(video_path, shape_predictor_path, max_frames=500, grayscale=False):
+    """
+        Returns the left and right eye crops of the first max_frames frames with a face
+    """
+    face = Face(shape_predictor_path, grayscale=grayscale)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video {video_path}.")
+
+    crops = []
+    frames = 0
+    while frames < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        try:
+            face.refresh(frame)
+        except ValueError:
+            continue
+        crops.extend([face.left_eye.frame, face.right_eye.frame])
+        frames += 1
+    cap.release()
+    return crops
+
+
+def save_crops(path, crops):
+    np.savez_compressed(path, **{f"crop_{i}": crop for i, crop in enumerate(crops)})
+
+
+def load_crops(path):
+    with np.load(path) as data:
+        return [data[f"crop_{i}"] for i in range(len(data.files))]
+
+
+def time_backend(crops, backend, repeats=5):
+    """
+        Returns the best time per crop over the repeats and the pupil positions found
+    """
+    best = float('inf')
+    positions = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pupils = [Pupil(crop, backend=backend) for crop in crops]
+        best = min(best, time.perf_counter() - start)
+        positions = [(pupil.x, pupil.y) for pupil in pupils]
+    return best / max(len(crops), 1), positions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pupil backends on recorded eye crops")
+    parser.add_argument("-v", "--video", type=str, help="Video to record eye crops from")
+    parser.add_argument("-sp", "--shape_predictor", type=str, default="shape_predictor_68_face_landmarks.dat", help="Path to shape predictor file")
+    parser.add_argument("-c", "--crops", type=str, help="Recorded eye crops (.npz), used instead of a video")
+    parser.add_argument("-s", "--save", type=str, help="Save the eye crops recorded from the video to this .npz file")
+    parser.add_argument("-n", "--max_frames", type=int, default=500, help="Frames with a face to record crops from")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="Timing repeats per backend")
+    parser.add_argument("-g", "--grayscale", action="store_true", help="Record grayscale crops")
+    args = parser.parse_args()
+
+    if args.crops:
+        crops = load_crops(args.crops)
+    elif args.video:
+        crops = record_eye_crops(args.video, args.shape_predictor, args.max_frames, args.grayscale)
+        if args.save:
+            save_crops(args.save, crops)
+    else:
+        parser.error("either --video or --crops is required")
+
+    contours_time, contours_positions = time_backend(crops, 'contours', args.repeats)
+    fast_time, fast_positions = time_backend(crops, 'fast', args.repeats)
+    mismatches = sum(a != b for a, b in zip(contours_positions, fast_positions))
+
+    print(f"{len(crops)} eye crops")
+    print(f"contours: {contours_time * 1e6:.1f} us/crop, fast: {fast_time * 1e6:.1f} us/crop "
+          f"({contours_time / max(fast_time, 1e-12):.2f}x)")
+    print(f"centroid mismatches: {mismatches}")
@@ -0,0 +1,132 @@
+import argparse
+import time
+import cv2
+import numpy as np
+
+from benchmark_baseline import check_baseline
+from eye import Eye
+from pupil import Pupil
+
+RESOLUTIONS = {'480p': (640, 480), '720p': (1280, 720), '1080p': (1920, 1080)}
+
+
+def synthetic_frame(width, height, seed=0):
+    """
+        Renders a BGR frame with two eyes (sclera, iris and pupil) on a noisy skin-like background.
+        Returns the frame and the 6 dlib-ordered landmarks of the left and right eye.
+    """
+    rng = np.random.default_rng(seed)
+    frame = np.full((height, width, 3), (140, 160, 195), np.uint8)
+    frame = cv2.add(frame, rng.integers(0, 25, frame.shape, dtype=np.uint8))
+
+    scale = height / 480
+    eye_w, eye_h = 28 * scale, 11 * scale
+    eyes = []
+    for cx in (width * 0.42, width * 0.58):
+        cy = height * 0.45
+        center = (int(cx), int(cy))
+        cv2.ellipse(frame, center, (int(eye_w), int(eye_h)), 0, 0, 360, (230, 230, 235), -1)
+        iris = (int(cx + rng.uniform(-0.3, 0.3) * eye_w), int(cy))
+        cv2.circle(frame, iris, int(eye_h * 0.9), (60, 45, 40), -1)
+        cv2.circle(frame, iris, int(eye_h * 0.4), (15, 10, 10), -1)
+
+        # corner, two upper lid, corner, two lower lid points
+        points = [(cx - eye_w, cy), (cx - eye_w / 3, cy - eye_h), (cx + eye_w / 3, cy - eye_h),
+                  (cx + eye_w, cy), (cx + eye_w / 3, cy + eye_h), (cx - eye_w / 3, cy + eye_h)]
+        eyes.append(np.rint(points).astype(int))
+    return frame, eyes[0], eyes[1]
+
+
+def throughput(function, min_time=0.2, repeats=3):
+    """
+        Calls per second of function, best of the repeats
+    """
+    best = 0.0
+    for _ in range(repeats):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            function()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, calls / elapsed)
+    return best
+
+
+def benchmark_eye_stages(frame, landmarks, label, results, min_time):
+    eye = Eye(frame, landmarks, threshold=None)
+    crop = eye.frame
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    results[f"grayscale@{label}"] = throughput(lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), min_time)
+    results[f"eye_isolation@{label}"] = throughput(lambda: eye._isolate(frame, landmarks), min_time)
+    results[f"eye_isolation_gray@{label}"] = throughput(lambda: eye._isolate(gray, landmarks), min_time)
+    results[f"ear@{label}"] = throughput(lambda: Eye._calculate_EAR(landmarks), min_time)
+    results[f"pupil_contours@{label}"] = throughput(lambda: Pupil(crop), min_time)
+    results[f"pupil_fast@{label}"] = throughput(lambda: Pupil(crop, backend='fast'), min_time)
+    results[f"eye@{label}"] = throughput(lambda: Eye(frame, landmarks, threshold=None), min_time)
+
+
+def benchmark_video(video_path, shape_predictor_path, results, max_frames, min_time):
+    """
+        Face.refresh on real frames and the eye stages on the first frame with a face
+    """
+    from face_detection import Face
+
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise ValueError(f"Could not read frames from {video_path}.")
+
+    face = Face(shape_predictor_path)
+    found = 0
+    start = time.perf_counter()
+    for frame in frames:
+        try:
+            face.refresh(frame)
+            found += 1
+        except ValueError:
+            pass
+    results["face_refresh@video"] = len(frames) / (time.perf_counter() - start)
+    print(f"{video_path}: face found in {found} of {len(frames)} frames")
+
+    for frame in frames:
+        try:
+            face.refresh(frame)
+        except ValueError:
+            continue
+        benchmark_eye_stages(frame, face.left_eye.landmark_points, "video", results, min_time)
+        break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-frame vision stages on synthetic (and optionally real) frames")
+    parser.add_argument("-r", "--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS), help="Synthetic frame resolutions")
+    parser.add_argument("-v", "--video", type=str, help="Also benchmark real frames from this video")
+    parser.add_argument("-sp", "--shape_predictor", type=str, default="shape_predictor_68_face_landmarks.dat", help="Path to shape predictor file (with --video)")
+    parser.add_argument("-n", "--max_frames", type=int, default=100, help="Frames read from the video")
+    parser.add_argument("-t", "--min_time", type=float, default=0.2, help="Seconds each stage is timed for")
+    parser.add_argument("-b", "--baseline", type=str, help="Baseline JSON to compare against")
+    parser.add_argument("--save_baseline", type=str, help="Save the results as a baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop against the baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for label in args.resolutions:
+        frame, left_eye, _ = synthetic_frame(*RESOLUTIONS[label])
+        benchmark_eye_stages(frame, left_eye, label, results, args.min_time)
+    if args.video:
+        benchmark_video(args.video, args.shape_predictor, results, args.max_frames, args.min_time)
+
+    for stage, calls in results.items():
+        print(f"{stage:28s} {calls:12.1f} /s")
+
+    check_baseline(results, args.save_baseline, args.baseline, args.tolerance, higher_is_better=True, unit='/s')
@@ -1,19 +1,29 @@
-import pandas as pd
+import numpy as np
 import os
 
+from event_buffer import EventBuffer
+from log_io import is_binary_log, save_log
+
 class BlinkAnalysis:
-    def __init__(self):
-        self.blink_df = pd.DataFrame(columns=['start_time', 'end_time', 'duration'])
+    def __init__(self, spill_path=None):
+        self.blinks = EventBuffer({
+            'start_time' : 'f8',
+            'end_time' : 'f8',
+            'duration' : 'f8'
+        }, spill_path=spill_path)
+
+    @property
+    def blink_df(self):
+        return self.blinks.to_dataframe()
     
     def add_blink(self, start_time, end_time):
         duration = self._blink_duration(start_time, end_time)
-
-        new_blink = pd.Series({
-            'start_time' : start_time,
-            'end_time' : end_time,
-            'duration' : duration
-        })
-        self.blink_df = pd.concat([self.blink_df, new_blink.to_frame().T], ignore_index=True)
+        self.blinks.append(start_time, end_time, duration)
+    
+    def add_blinks(self, start_times, end_times):
+        start_times = np.asarray(start_times, dtype=float)
+        end_times = np.asarray(end_times, dtype=float)
+        self.blinks.extend(start_times, end_times, self._blink_duration(start_times, end_times))
     
     @staticmethod
     def _blink_duration(start_time, end_time):
@@ -43,10 +53,14 @@ class BlinkAnalysis:
       
     def _get_df_last_minute(self):
         current_time = self.get_time_from_start()
-        last_min = self.blink_df[self.blink_df['start_time'] > current_time - 60]
+        blink_df = self.blink_df
+        last_min = blink_df[blink_df['start_time'] > current_time - 60]
         return last_min
     
     def save_data(self, file_name):
+        if is_binary_log(file_name):
+            save_log(self.blink_df, file_name)
+            return
         if not file_name.endswith('.csv'):
             file_name += '.csv'
         file_path = os.path.join(file_name)
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+def _next_true(mask):
+    """
+        For every index i returns the first index j >= i where mask is True (len(mask) if none)
+    """
+    n = len(mask)
+    idx = np.where(mask, np.arange(n), n)
+    return np.append(np.minimum.accumulate(idx[::-1])[::-1], n)
+
+
+def carry_forward(face_found):
+    """
+        Returns the indices of the frames the blink/gaze logic sees and, for each of them,
+        the index of the last frame with a face. Frames before the first face are dropped,
+        later frames without a face reuse the last observation.
+    """
+    face_found = np.asarray(face_found, dtype=bool)
+    found_idx = np.where(face_found, np.arange(len(face_found)), -1)
+    source = np.maximum.accumulate(found_idx) if len(found_idx) else found_idx
+    frames = np.flatnonzero(source >= 0)
+    return frames, source[frames]
+
+
+def detect_blinks(left_ear, right_ear, timestamps, threshold, face_found=None, debounce=0.05):
+    """
+        Offline version of the blink logic in FrameLogger over whole EAR arrays.
+        A blink starts on the first frame with one eye closed, its end is marked on the first later
+        frame where not both eyes are closed, and it is logged on the first frame with not both eyes
+        closed at least `debounce` seconds after that mark.
+        The per-frame work is vectorized, the remaining loop runs once per blink.
+        Returns start, end and duration arrays.
+    """
+    left_ear = np.asarray(left_ear, dtype=float)
+    right_ear = np.asarray(right_ear, dtype=float)
+    timestamps = np.asarray(timestamps, dtype=float)
+
+    if face_found is not None:
+        frames, source = carry_forward(face_found)
+        left_ear, right_ear, timestamps = left_ear[source], right_ear[source], timestamps[frames]
+
+    if threshold is None or len(timestamps) == 0:
+        return np.array([]), np.array([]), np.array([])
+
+    left_closed = left_ear <= threshold
+    right_closed = right_ear <= threshold
+    # a start time of 0 means "no blink" in the frame loop, so frames at t == 0 can't start one
+    next_start = _next_true((left_closed | right_closed) & (timestamps != 0))
+    next_open = _next_true(~(left_closed & right_closed))
+    n = len(timestamps)
+
+    starts, ends = [], []
+    i = 0
+    while True:
+        start = next_start[i]
+        if start >= n:
+            break
+        blink_end = next_open[start + 1]
+        if blink_end >= n:
+            break
+
+        # first frame at least `debounce` after the end mark
+        k = int(np.searchsorted(timestamps, timestamps[blink_end] + debounce, side='left'))
+        while k > blink_end and timestamps[k - 1] - timestamps[blink_end] >= debounce:
+            k -= 1
+        while k < n and timestamps[k] - timestamps[blink_end] < debounce:
+            k += 1
+
+        logged = next_open[max(k, blink_end)]
+        if logged >= n:
+            break
+        starts.append(timestamps[start])
+        ends.append(timestamps[logged])
+        i = logged + 1
+
+    starts, ends = np.array(starts), np.array(ends)
+    return starts, ends, ends - starts
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import os
+    import time
+    from blink_analysis import BlinkAnalysis
+    from gaze_analysis import GazeAnalysis
+    from blink_gaze_tracker import FrameLogger, observation_from_features, logs_from_features
+    from feature_store import session_geometry
+
+    parser = argparse.ArgumentParser(description="Compare the vectorized blink extraction with the frame loop on a feature store")
+    parser.add_argument("features", help="Feature store .npy file")
+    parser.add_argument("-t", "--threshold", type=float, required=True, help="EAR threshold")
+    args = parser.parse_args()
+
+    with open(os.path.splitext(args.features)[0] + '.json') as f:
+        meta = json.load(f)
+    features = np.load(args.features, mmap_mode='r')[:meta['rows']]
+
+    start = time.perf_counter()
+    blink_log, gaze_log = BlinkAnalysis(), GazeAnalysis()
+    logger = FrameLogger(blink_log, gaze_log, args.threshold)
+    for row in features:
+        logger.update(float(row['timestamp']), observation_from_features(row))
+    inline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector_blink_log, vector_gaze_log = logs_from_features(features, args.threshold)
+    vector_time = time.perf_counter() - start
+
+    blinks_match = blink_log.blink_df.equals(vector_blink_log.blink_df)
+    gaze_match = gaze_log.points.to_dataframe().equals(vector_gaze_log.points.to_dataframe())
+    print(f"{len(features)} frames, {len(blink_log.blinks)} blinks, {len(gaze_log.points)} gaze points")
+    print(f"frame loop: {inline_time:.3f}s, vectorized: {vector_time:.3f}s ({inline_time / max(vector_time, 1e-9):.1f}x)")
+    print(f"blinks match: {blinks_match}, gaze points match: {gaze_match}")
+
+    start = time.perf_counter()
+    geometry = session_geometry(features)
+    geometry_time = time.perf_counter() - start
+    ears_match = all(np.array_equal(geometry[name], features[name], equal_nan=True) for name in ('left_ear', 'right_ear'))
+    print(f"EAR recomputed from the stored landmarks in {geometry_time:.3f}s, matches stored EAR: {ears_match}")
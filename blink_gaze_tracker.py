@@ -1,20 +1,229 @@
+import multiprocessing
+import os
+import time
 import cv2
+import numpy as np
 import pandas as pd
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
+import model_registry
 from face_detection import Face
+from feature_store import FEATURE_DTYPE, face_features
+from blink_detection import carry_forward, detect_blinks
+from frame_pipeline import FramePrefetcher, frame_timestamps
+from profiling import NULL_PROFILER
 from blink_analysis import BlinkAnalysis
 from gaze_analysis import GazeAnalysis
 
+# Everything the blink/gaze logic needs from one analyzed frame
+FrameObservation = namedtuple('FrameObservation', [
+    'left_ear', 'right_ear',
+    'left_eye_vector', 'right_eye_vector',
+    'left_eye_dim', 'right_eye_dim'
+])
+
+
+def observation_from_features(row):
+    """
+        Rebuilds the FrameObservation of a feature store row (see feature_store.FEATURE_DTYPE),
+        returns None for frames where no face was found
+    """
+    if not row['face_found']:
+        return None
+
+    left_eye_dim = (int(row['left_eye_h']), int(row['left_eye_w']))
+    right_eye_dim = (int(row['right_eye_h']), int(row['right_eye_w']))
+    left_eye_vector, right_eye_vector = None, None
+    # like Face.gaze_detection, both pupils are needed for a gaze vector
+    if not np.isnan([row['left_pupil_x'], row['right_pupil_x']]).any():
+        left_eye_vector = [float(row['left_pupil_x']) - left_eye_dim[1]/2, float(row['left_pupil_y']) - left_eye_dim[0]/2]
+        right_eye_vector = [float(row['right_pupil_x']) - right_eye_dim[1]/2, float(row['right_pupil_y']) - right_eye_dim[0]/2]
+
+    return FrameObservation(
+        left_ear=float(row['left_ear']),
+        right_ear=float(row['right_ear']),
+        left_eye_vector=left_eye_vector,
+        right_eye_vector=right_eye_vector,
+        left_eye_dim=left_eye_dim,
+        right_eye_dim=right_eye_dim
+    )
+
+
+def logs_from_features(features, threshold):
+    """
+        Derives the blink and gaze logs of a session from its stored per-frame features
+        for the given EAR threshold, without decoding the video again.
+        Gives the same events as feeding the rows through FrameLogger.
+    """
+    blink_log, gaze_log = BlinkAnalysis(), GazeAnalysis()
+
+    start_times, end_times, _ = detect_blinks(features['left_ear'], features['right_ear'], features['timestamp'],
+                                              threshold, face_found=features['face_found'])
+    blink_log.add_blinks(start_times, end_times)
+
+    # Every frame logs the gaze vectors of the frame before it, like FrameLogger.update
+    frames, source = carry_forward(features['face_found'])
+    if len(frames) > 1:
+        times = np.asarray(features['timestamp'])[frames]
+        seen = np.asarray(features)[source]
+        left_h, left_w = seen['left_eye_h'], seen['left_eye_w']
+        right_h, right_w = seen['right_eye_h'], seen['right_eye_w']
+        left_x = seen['left_pupil_x'].astype(float) - left_w / 2
+        left_y = seen['left_pupil_y'].astype(float) - left_h / 2
+        right_x = seen['right_pupil_x'].astype(float) - right_w / 2
+        right_y = seen['right_pupil_y'].astype(float) - right_h / 2
+
+        previous = np.flatnonzero(~(np.isnan(left_x[:-1]) | np.isnan(right_x[:-1])))
+        current = previous + 1
+        gaze_log.points.extend(
+            left_x[previous], left_y[previous],
+            right_x[previous], right_y[previous],
+            times[previous], times[current],
+            left_h[current], left_w[current],
+            right_h[current], right_w[current]
+        )
+    return blink_log, gaze_log
+
+
+class FrameLogger:
+    """
+    Turns frame observations into blink and gaze events.
+    Frames where no face was found (observation None) repeat the last observation,
+    frames before the first detected face are ignored.
+    """
+    def __init__(self, blink_log, gaze_log, threshold):
+        self.blink_log = blink_log
+        self.gaze_log = gaze_log
+        self.threshold = threshold
+
+        self.last_observation = None
+        self.blink_start_time = 0
+        self.blink_end = None
+        self.left_eye_vector, self.right_eye_vector = None, None
+        self.gaze_start_time = 0
+
+    def update(self, current_time, observation):
+        if observation is None:
+            observation = self.last_observation
+            if observation is None:
+                return
+        self.last_observation = observation
+
+        # gaze detection part
+        self.gaze_log.add_point(self.left_eye_vector, self.right_eye_vector, self.gaze_start_time, current_time,
+                                observation.left_eye_dim, observation.right_eye_dim)
+        self.left_eye_vector = observation.left_eye_vector
+        self.right_eye_vector = observation.right_eye_vector
+        self.gaze_start_time = current_time
+
+        # Blink detection
+        left_eye_closed, right_eye_closed = self._closed_eyes(observation)
+        if self.blink_start_time == 0 and (left_eye_closed or right_eye_closed):
+            self.blink_start_time = current_time
+
+        elif self.blink_start_time != 0 and not (left_eye_closed and right_eye_closed):
+            if self.blink_end is None:
+                self.blink_end = current_time
+            if current_time - self.blink_end >= 0.05:
+                self.blink_log.add_blink(self.blink_start_time, current_time)
+                self.blink_start_time = 0
+                self.blink_end = None
+
+    def _closed_eyes(self, observation):
+        if self.threshold is None:
+            return False, False
+        return observation.left_ear <= self.threshold, observation.right_ear <= self.threshold
+
+
+def _seek(cap, source, start_frame):
+    """
+        Positions the capture on start_frame, falling back to grabbing frames
+        when the container can't seek frame-accurately
+    """
+    if start_frame == 0:
+        return cap
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if fps > 0 and cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame):
+        # POS_FRAMES only echoes the requested position, the timestamp of a decoded frame shows where the seek landed
+        landed = cap.get(cv2.CAP_PROP_POS_MSEC) * fps / 1000 if cap.grab() else None
+        if landed is not None and abs(landed - start_frame) < 0.5 and cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame):
+            return cap
+
+    cap.release()
+    cap = cv2.VideoCapture(source)
+    for _ in range(start_frame):
+        if not cap.grab():
+            break
+    return cap
+
+
+def _analyze_shard(shard):
+    """
+        Worker process: analyzes the frames [start_frame, stop_frame) of the video with its own Face.
+        Returns the feature rows of the frames, the face detection stats and the worker stats
+        (pid, wall clock time of the first analyzed frame, whether the model had to be loaded, peak RSS).
+    """
+    source, shape_predictor_path, face_options, ear_threshold, start_frame, stop_frame, timestamps, prefetch_depth = shard
+    predictor_loads = model_registry.load_stats['predictor_loads']
+    face = Face(shape_predictor_path, **face_options)
+    face.set_ear_threshold(ear_threshold)
+    worker = {'pid': os.getpid(), 'first_frame': None,
+              'loaded_model': model_registry.load_stats['predictor_loads'] > predictor_loads}
+
+    cap = _seek(cv2.VideoCapture(source), source, start_frame)
+    reader = FramePrefetcher(cap, prefetch_depth, grayscale=True, max_frames=stop_frame - start_frame).start() if prefetch_depth > 0 else None
+    features = np.zeros(stop_frame - start_frame, dtype=FEATURE_DTYPE)
+    rows = 0
+    for frame_num in range(start_frame, stop_frame):
+        if reader is not None:
+            ret, frame, gray = reader.read()
+        else:
+            ret, frame = cap.read()
+            gray = None
+        if not ret:
+            break
+        try:
+            face.refresh(frame, gray)
+            features[rows] = face_features(frame_num, timestamps[rows], face)
+        except ValueError:
+            features[rows] = face_features(frame_num, timestamps[rows], None)
+        rows += 1
+        if worker['first_frame'] is None:
+            worker['first_frame'] = time.time()
+    if reader is not None:
+        reader.stop()
+    cap.release()
+
+    worker['peak_rss_mb'] = model_registry.peak_rss_mb()
+    return features[:rows], face.detection_stats, worker
+
+
 class BlinkGazeTracker:
-    def __init__(self, shape_predictor_path, blink_log_file_name, gaze_log_file_name, EAR_threshold):
-        self.detected_face = Face(shape_predictor_path)
+    def __init__(self, shape_predictor_path, blink_log_file_name, gaze_log_file_name, EAR_threshold, face_options=None, workers=1,
+                 prefetch_depth=0, prefork=False, profiler=None):
+        self.created = time.perf_counter()
+        # face_options are passed on to Face, e.g. {'detect_every': 5} to track the face box between detections
+        self.face_options = face_options or {}
+        self.shape_predictor_path = shape_predictor_path
+        self.detected_face = Face(shape_predictor_path, **self.face_options)
+        # workers > 1 splits the video into frame ranges analyzed in separate processes
+        self.workers = workers
+        # prefetch_depth > 0 decodes frames ahead on a reader thread into a queue of that size
+        self.prefetch_depth = prefetch_depth
+        # prefork forks the workers from this process after the models are loaded,
+        # so they share the loaded models copy-on-write instead of loading their own
+        self.prefork = prefork
+        # a profiling.StageProfiler times the stages of the serial run and prints a summary at the end
+        self.profiler = profiler or NULL_PROFILER
+        self.detected_face.profiler = self.profiler
 
         self.blink_log = BlinkAnalysis()
         self.gaze_log = GazeAnalysis()
 
         self.blink_log_name = blink_log_file_name
         self.gaze_log_name = gaze_log_file_name
-        self.detected_face.set_ear_threshold(EAR_threshold)        
+        self.detected_face.set_ear_threshold(EAR_threshold)
         '''
         try:
             self.analyze_video(video_source)
@@ -22,8 +231,12 @@ class BlinkGazeTracker:
             print(e)
         '''
 
-    
-    def analyze_video(self, source):
+
+    def analyze_video(self, source, feature_store=None):
+        """
+            Analyzes the video and saves the blink and gaze logs.
+            If a FeatureStore is given, the per-frame features are recorded in it as well.
+        """
 
         cap = cv2.VideoCapture(source)
 
@@ -32,73 +245,145 @@ class BlinkGazeTracker:
 
         fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        frame_time = 1/fps
-
-        blink_start_time = 0
-        blink_end = None
-        left_eye_vector, right_eye_vector = None, None
-        face_detected = False
-        
-        gaze_start_time = 0
-        #blink_start_time = 0
-        frame_num = 0
-        
-        while frame_num < total_frames:
-            #current_time = time.time() - self.start_time
-            ret, frame = cap.read()
-            if not ret:
-                break
-            current_time = frame_num * frame_time
-            try:
-                self.detected_face.refresh(frame)
-                face_detected = True
-            
-            except ValueError as e:
-                pass
-
-            # gaze detection part
-            if face_detected:
-                new_left_eye_vector, new_right_eye_vector = self.detected_face.gaze_detection()
-                #print(new_left_eye_vector, new_right_eye_vector)
-
-                if(left_eye_vector, right_eye_vector != new_left_eye_vector, new_right_eye_vector):
-                    left_eye_dim = self.detected_face.left_eye.frame.shape[:2]
-                    right_eye_dim = self.detected_face.right_eye.frame.shape[:2]
-                    self.gaze_log.add_point(left_eye_vector, right_eye_vector, gaze_start_time,current_time, left_eye_dim, right_eye_dim)
-                #print(gaze_start_time > current_time)
-                    left_eye_vector = new_left_eye_vector
-                    right_eye_vector = new_right_eye_vector
-                    gaze_start_time = current_time
-                
-                # Blink detection
-                
-                #print(self.detected_face.right_eye.ear, self.detected_face.left_eye.ear, self.detected_face.right_eye.threshold)
-                left_eye_closed, right_eye_closed = self.detected_face.closed_eyes()
-                if blink_start_time == 0 and (left_eye_closed or right_eye_closed):
-                    blink_start_time = current_time
-                
-                elif blink_start_time != 0 and not (left_eye_closed and right_eye_closed):
-                    if(blink_end is None):
-                        blink_end = current_time
-                    if(current_time - blink_end >= 0.05):
-                        self.blink_log.add_blink(blink_start_time, current_time)
-                        blink_start_time = 0
-                        blink_end = None
-            frame_num += 1
-            
-            #cv2.imshow("webcam detections", self.detected_face.highlight_landmarks())
-            
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-            
-        cap.release()
-        cv2.destroyAllWindows()
+        # recordings made by WebcamRecorder carry the capture time of every frame
+        timestamps = frame_timestamps(source, total_frames, fps)
+
+        # nothing tracked in an earlier video carries over to this one
+        self.detected_face.reset_tracking()
+        logger = FrameLogger(self.blink_log, self.gaze_log, self.detected_face.threshold)
+        if feature_store is not None:
+            feature_store.create(total_frames)
+
+        aborted = False
+        try:
+            if self.workers > 1:
+                cap.release()
+                # the workers' stats are summed up on the tracker's Face, so its rate helpers cover the whole video
+                self.detected_face.detection_stats = self._analyze_sharded(source, total_frames, timestamps, logger, feature_store)
+            else:
+                reader = None
+                if self.prefetch_depth > 0:
+                    reader = FramePrefetcher(cap, self.prefetch_depth, grayscale=True, max_frames=total_frames).start()
+
+                profiler = self.profiler
+                frame_num = 0
+                while frame_num < total_frames:
+                    start = profiler.clock()
+                    if reader is not None:
+                        ret, frame, gray = reader.read()
+                    else:
+                        ret, frame = cap.read()
+                        gray = None
+                    profiler.record('decode', start)
+                    if not ret:
+                        break
+                    current_time = float(timestamps[frame_num])
+                    try:
+                        self.detected_face.refresh(frame, gray)
+                        row = face_features(frame_num, current_time, self.detected_face)
+                    except ValueError:
+                        row = face_features(frame_num, current_time, None)
+
+                    start = profiler.clock()
+                    if feature_store is not None:
+                        feature_store.record(row)
+                    logger.update(current_time, observation_from_features(np.array(row, dtype=FEATURE_DTYPE)))
+                    profiler.record('logging', start)
+                    profiler.next_frame()
+                    if frame_num == 0:
+                        print(f"Time to first frame: {time.perf_counter() - self.created:.2f}s (model loading included)")
+                    frame_num += 1
+
+                    #cv2.imshow("webcam detections", self.detected_face.highlight_landmarks())
+
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        aborted = True
+                        break
+
+                if reader is not None:
+                    reader.stop()
+                    print(reader.report())
+                cap.release()
+                cv2.destroyAllWindows()
+                rss = model_registry.peak_rss_mb()
+                if rss is not None:
+                    print(f"Peak RSS: {rss:.0f} MB")
+                if profiler.enabled:
+                    print(profiler.report())
+                    profiler.save_trace()
+        except BaseException:
+            # a half written store must not be taken for the features of the whole video
+            if feature_store is not None:
+                feature_store.discard()
+            raise
+
+        detection_stats = self.detected_face.detection_stats
+        if self.detected_face.detect_every > 1:
+            print(f"Face tracking: {detection_stats['full_detections']} full detections in {detection_stats['frames']} frames "
+                  f"({self.detected_face.detection_fallback_rate():.1%}), tracking lost {detection_stats['tracking_lost']} times")
+        if self.detected_face.flow_refresh > 1:
+            print(f"Landmark flow: {detection_stats['flow']} of {detection_stats['frames']} frames ({self.detected_face.flow_rate():.1%}), "
+                  f"shape predictor rerun {detection_stats['flow_lost']} times on flow error or EAR jump")
+        if self.detected_face.detect_scale < 1:
+            print(f"Scaled detection: {detection_stats['scale_fallbacks']} of {detection_stats['full_detections']} detections "
+                  f"fell back to full resolution, {detection_stats['upsampled']} upsampled")
+        if feature_store is not None:
+            # a run stopped with 'q' covers only part of the video and is not kept
+            feature_store.close(fps, complete=not aborted)
         self.blink_log.save_data(self.blink_log_name)
         self.gaze_log.save_data(self.gaze_log_name)
 
+    def _analyze_sharded(self, source, total_frames, timestamps, logger, feature_store=None):
+        """
+            Analyzes the video in self.workers frame ranges in parallel.
+            The shards are fed to the logger in frame order, so blinks and gaze segments
+            crossing a shard boundary are stitched exactly like in the serial run.
+            Face tracking (detect_every, flow_refresh > 1) starts over at every shard,
+            so only the default face options give the same features as the serial run.
+        """
+        shard_size = max(1, -(-total_frames // self.workers))
+        shards = [(source, self.shape_predictor_path, self.face_options, self.detected_face.threshold,
+                   start, min(start + shard_size, total_frames), timestamps[start:start + shard_size], self.prefetch_depth)
+                  for start in range(0, total_frames, shard_size)]
+
+        mp_context = None
+        if self.prefork:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                # fork explicitly, spawn (macOS) and forkserver (Python 3.14+) defaults would load
+                # the models again in every worker. No other thread runs in this process here.
+                seconds = model_registry.preload(self.shape_predictor_path)
+                print(f"Models preloaded in {seconds:.2f}s, workers inherit them copy-on-write")
+                mp_context = multiprocessing.get_context('fork')
+            else:
+                print("fork is not available on this platform, every worker loads its own models")
+
+        detection_stats = dict.fromkeys(self.detected_face.detection_stats, 0)
+        submitted = time.time()
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context) as pool:
+            futures = [pool.submit(_analyze_shard, shard) for shard in shards]
+            for (_, _, _, _, start, stop, _, _), future in zip(shards, futures):
+                features, stats, worker = future.result()
+                first_frame = f"{worker['first_frame'] - submitted:.2f}s" if worker['first_frame'] is not None else "-"
+                rss = f"{worker['peak_rss_mb']:.0f} MB" if worker['peak_rss_mb'] is not None else "unknown"
+                print(f"Shard {start}-{stop} (worker {worker['pid']}): first frame after {first_frame}, "
+                      f"model {'loaded' if worker['loaded_model'] else 'shared'}, peak RSS {rss}")
+                if feature_store is not None:
+                    feature_store.record_many(features)
+                for row in features:
+                    logger.update(float(row['timestamp']), observation_from_features(row))
+                for key in detection_stats:
+                    detection_stats[key] += stats[key]
+
+                # the serial run stops at the first frame that can't be read
+                if len(features) < stop - start:
+                    for pending in futures:
+                        pending.cancel()
+                    break
+
+        return detection_stats
+
 if __name__ == "__main__":
     shape_predictor = "shape_predictor_68_face_landmarks.dat"
     face_analysis = BlinkGazeTracker(shape_predictor,'test_blink','test_gaze')
 
     face_analysis.analyze_video('data/video_recording_test.avi', 'data/user_inputs_test.csv')
-
@@ -65,13 +65,18 @@ class Calibration:
             stop_event=self.stop_event
         )
 
-    def start_calibration(self, shape_predictor_path = "shape_predictor_68_face_landmarks.dat"):
+    def start_calibration(self, shape_predictor_path = "shape_predictor_68_face_landmarks.dat", frame_budget_ms=None):
         # Import external modules (ensure these are in your PYTHONPATH)
         from face_detection import Face
         from gaze_analysis import GazeAnalysis
+        from event_buffer import EventBuffer
+        from frame_budget import FrameBudget, QUALITY_LEVELS
 
         detected_face = Face(shape_predictor_path)
         gaze_log = GazeAnalysis()
+        # with a frame budget the analysis sheds quality when it falls behind, every frame is tagged with the level used
+        budget = FrameBudget(frame_budget_ms) if frame_budget_ms else None
+        frame_quality = EventBuffer({'time': 'f8', 'quality': object}, capacity=256)
 
         # Start the keyboard listener thread
         self.keyboard_listener.start()
@@ -102,11 +107,19 @@ class Calibration:
                     print("Stop event triggered. Exiting calibration loop.")
                     break
                 face_detected = False
-                try:
-                    detected_face.refresh(frame)
-                    face_detected = True
-                except ValueError as e:
-                    face_detected = False
+                # the gaze points of the reading phase give the subject's velocity threshold,
+                # so frames and pupils are never shed while it runs
+                keep_gaze = start_velocity_calibration or self.keyboard_listener.reading_calibration
+                analysis_start = time.perf_counter()
+                analyzed = budget is None or budget.should_analyze(keep_rate=keep_gaze)
+                if analyzed:
+                    if budget is not None:
+                        budget.apply(detected_face, keep_pupil=keep_gaze)
+                    try:
+                        detected_face.refresh(frame)
+                        face_detected = True
+                    except ValueError as e:
+                        face_detected = False
                 
                 def avg_ear_value():
                     ear_value = (detected_face.right_eye.ear + detected_face.left_eye.ear) / 2
@@ -140,7 +153,6 @@ class Calibration:
                         gaze_start_time = current_time
                 
                 elif start_velocity_calibration and face_detected:
-                    detected_face.refresh(frame)
                     new_left_eye_vector, new_right_eye_vector = detected_face.gaze_detection()
                     if (left_eye_vector, right_eye_vector) != (new_left_eye_vector, new_right_eye_vector):
                         left_eye_dim = detected_face.left_eye.frame.shape[:2]
@@ -155,6 +167,15 @@ class Calibration:
                     start_velocity_calibration = False
                     # Optionally save calibration data here
 
+                # the budget covers all the work done on the frame
+                if not analyzed:
+                    quality = 'skipped'
+                elif budget is not None:
+                    quality = budget.record(time.perf_counter() - analysis_start)
+                else:
+                    quality = QUALITY_LEVELS[0]
+                frame_quality.append(current_time, quality)
+
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     self.keyboard_listener.stop_event.set()
                     break
@@ -176,15 +197,20 @@ class Calibration:
         # small pause to let everything settle
             time.sleep(0.2)
 
+        if budget is not None:
+            print(budget.report())
+        self.frame_quality = frame_quality.to_dataframe()
         self.ear_values = pd.Series(ear_values)
-        self.gaze_df = gaze_log.gaze_df
+        # flat columns (left_eye_x, left_eye_y, ...), the same layout as the binary gaze logs
+        self.gaze_df = gaze_log.points.to_dataframe()
 
     def data_process(self):
         # Placeholder for data processing implementation
         avg_ear = self.ear_values.mean()
 
-        self.gaze_df['left_eye_x'] = self.gaze_df['left_eye_from_center'].apply(lambda x: x[0])
-        self.gaze_df['right_eye_x'] = self.gaze_df['right_eye_from_center'].apply(lambda x: x[0])
+        if 'left_eye_x' not in self.gaze_df.columns:
+            self.gaze_df['left_eye_x'] = self.gaze_df['left_eye_from_center'].apply(lambda x: x[0])
+            self.gaze_df['right_eye_x'] = self.gaze_df['right_eye_from_center'].apply(lambda x: x[0])
 
         # Ensure a time column exists by copying from 'start_time'
         if 'time' not in self.gaze_df.columns:
@@ -192,6 +218,7 @@ class Calibration:
         def compute_avg_velocity():
             gaze_df = self.gaze_df.copy()
             import numpy as np
+            from fixation import central_difference_velocity
         
         # Ensure a time column exists
             if 'start_time' not in gaze_df.columns:
@@ -203,16 +230,7 @@ class Calibration:
             
             x_positions = gaze_df['x_pos'].values
             times = gaze_df['time'].values
-            velocity = np.zeros(len(x_positions))
-            
-            #Compute central differences for interior points.
-            for i in range(1, len(x_positions) - 1):
-                dt = times[i + 1] - times[i - 1]
-                velocity[i] = (x_positions[i + 1] - x_positions[i - 1]) / dt if dt != 0 else 0
-            # Handle boundary values
-            if len(velocity) > 1:
-                velocity[0] = velocity[1]
-                velocity[-1] = velocity[-2]
+            velocity = central_difference_velocity(x_positions, times)
             
             gaze_df['velocity'] = velocity        
             # Return the average absolute velocity (or customize as needed)
@@ -228,6 +246,7 @@ class Calibration:
     
 import argparse    
 from presentation_handler import PresentationHandler
+from log_io import LOG_FORMATS, log_file_name, save_log
 import os
 
 if __name__ == '__main__':
@@ -235,13 +254,15 @@ if __name__ == '__main__':
     p.add_argument("-f", "--folder",required=True,  help="Folder to write calibration_values_{subject}.csv")
     p.add_argument("-s", "--subject",required=True,  help="Subject ID, used in file name")
     p.add_argument("-sp","--shape_predictor",required=True,  help="Path to shape_predictor_68_face_landmarks.dat")
+    p.add_argument("-lf","--log_format", default="npz", choices=LOG_FORMATS, help="File format of the saved calibration gaze log")
+    p.add_argument("-fb","--frame_budget", type=float, default=None, help="Per-frame analysis budget in ms, analysis quality is lowered while it is exceeded")
     args = p.parse_args()
 
 
     calib = Calibration()
     presentation = PresentationHandler("presentation/calibration.pptx")
     presentation.open_presentation()
-    calib.start_calibration()
+    calib.start_calibration(frame_budget_ms=args.frame_budget)
     # After calibration, you can call calib.data_process() or save results as needed.
     
     avf_ear, avg_velocity = calib.data_process()
@@ -258,5 +279,13 @@ if __name__ == '__main__':
     df = pd.DataFrame(data)
     df.to_csv(output_file, index=False)
     print(f"Calibration values saved to {output_file}")
+
+    gaze_log_file = os.path.join(output_dir, log_file_name(f"calibration_gaze_log_{args.subject}", args.log_format))
+    save_log(calib.gaze_df, gaze_log_file)
+    print(f"Calibration gaze log saved to {gaze_log_file}")
+
+    quality_file = os.path.join(output_dir, f"calibration_frame_quality_{args.subject}.csv")
+    calib.frame_quality.to_csv(quality_file, index=False)
+    print(f"Calibration frame quality saved to {quality_file}")
     
     
@@ -1,22 +1,44 @@
 import os
 import pandas as pd
 import numpy as np
-from blink_gaze_tracker import BlinkGazeTracker  # Import your tracker class
+from blink_gaze_tracker import BlinkGazeTracker, logs_from_features  # Import your tracker class
+from feature_store import FeatureStore
+from profiling import StageProfiler
+from log_io import LOG_FORMATS, log_file_name, read_log, save_log
 
 def run_blink_gaze_tracker(video_file, user_inputs_file, output_folder,file_name, EAR,
-                           shape_predictor="shape_predictor_68_face_landmarks.dat"):
+                           shape_predictor="shape_predictor_68_face_landmarks.dat", workers=1, log_format='csv',
+                           prefetch_depth=0, use_feature_store=False, face_options=None, prefork=False, profile=False,
+                           trace_file=None):
     """
     Uses BlinkGazeTracker to process the video and generate blink and gaze logs.
     If the log files already exist, this step is skipped.
+    With workers > 1 the video is analyzed in parallel frame ranges.
+    log_format is 'csv' or one of the binary formats ('npz', 'parquet', 'feather').
+    prefetch_depth > 0 decodes frames ahead on a reader thread.
+    With use_feature_store the per-frame features are cached next to the video, and once
+    they exist the logs are always derived again from them for the given EAR threshold.
+    face_options are passed on to Face, e.g. {'flow_refresh': 5}.
+    With prefork the workers are forked after the models are loaded and share them.
+    With profile a serial run prints the time spent per pipeline stage, trace_file saves it per frame.
     """
-    blink_log_path = os.path.join(output_folder, f"{file_name}_blink_log.csv")
-    gaze_log_path = os.path.join(output_folder, f"{file_name}_gaze_log.csv")
-    
+    blink_log_path = os.path.join(output_folder, log_file_name(f"{file_name}_blink_log", log_format))
+    gaze_log_path = os.path.join(output_folder, log_file_name(f"{file_name}_gaze_log", log_format))
+
+    feature_store = FeatureStore(video_file, shape_predictor, face_options) if use_feature_store else None
+    if feature_store is not None and feature_store.exists():
+        print("Deriving blink and gaze logs from the cached frame features...")
+        blink_log, gaze_log = logs_from_features(feature_store.load(), EAR)
+        blink_log.save_data(blink_log_path)
+        gaze_log.save_data(gaze_log_path)
+
     # Run the tracker only if one or both log files don't exist.
-    if not os.path.exists(blink_log_path) or not os.path.exists(gaze_log_path):
+    elif not os.path.exists(blink_log_path) or not os.path.exists(gaze_log_path):
         print("Running BlinkGazeTracker to generate logs...")
-        tracker = BlinkGazeTracker(shape_predictor, blink_log_path, gaze_log_path , EAR)
-        tracker.analyze_video(video_file)
+        tracker = BlinkGazeTracker(shape_predictor, blink_log_path, gaze_log_path , EAR, face_options=face_options, workers=workers,
+                                   prefetch_depth=prefetch_depth, prefork=prefork,
+                                   profiler=StageProfiler(trace_file) if profile or trace_file else None)
+        tracker.analyze_video(video_file, feature_store=feature_store)
     else:
         print("Blink and gaze logs already exist, skipping video processing.")
     
@@ -25,26 +47,29 @@ def run_blink_gaze_tracker(video_file, user_inputs_file, output_folder,file_name
 def load_data(blink_log_path, gaze_log_path, user_inputs_path):
     """
     Loads blink and gaze logs along with the user inputs CSV.
+    The logs can be CSV or binary (.npz, .parquet, .feather) and are written back in the same format.
     """
     
-    blink_df = pd.read_csv(blink_log_path) if os.path.exists(blink_log_path) else pd.DataFrame()
+    blink_df = read_log(blink_log_path) if os.path.exists(blink_log_path) else pd.DataFrame()
     #print("blink_df loaded from:", blink_log_path)
-    gaze_df = pd.read_csv(gaze_log_path) if os.path.exists(gaze_log_path) else pd.DataFrame()
+    gaze_df = read_log(gaze_log_path) if os.path.exists(gaze_log_path) else pd.DataFrame()
     user_inputs_df = pd.read_csv(user_inputs_path)
 
-    import ast
+    # binary logs already have flat eye columns, CSV logs store the vectors as strings
+    if 'left_eye_x' not in gaze_df.columns or 'right_eye_x' not in gaze_df.columns:
+        import ast
 
-    for col in ['left_eye_from_center', 'right_eye_from_center']:
-        if col in gaze_df.columns:
-            gaze_df[col] = gaze_df[col].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else x)
+        for col in ['left_eye_from_center', 'right_eye_from_center']:
+            if col in gaze_df.columns:
+                gaze_df[col] = gaze_df[col].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else x)
 
-    gaze_df['left_eye_x'] = gaze_df['left_eye_from_center'].apply(lambda p: p[0])
-    gaze_df['right_eye_x'] = gaze_df['right_eye_from_center'].apply(lambda p: p[0])
+        gaze_df['left_eye_x'] = gaze_df['left_eye_from_center'].apply(lambda p: p[0])
+        gaze_df['right_eye_x'] = gaze_df['right_eye_from_center'].apply(lambda p: p[0])
 
     new_blink_df, new_gaze_df = split_by_slides(blink_df, gaze_df, user_inputs_df)
 
-    new_blink_df.to_csv(blink_log_path, index=False)
-    new_gaze_df.to_csv(gaze_log_path, index=False)
+    save_log(new_blink_df, blink_log_path)
+    save_log(new_gaze_df, gaze_log_path)
 
 def split_events_by_slide(events_df, slide_times, session_end=None):
     """
@@ -60,46 +85,50 @@ def split_events_by_slide(events_df, slide_times, session_end=None):
         pd.DataFrame: A new DataFrame with events split by slide intervals.
     """
     # Ensure slide_times are sorted
-    slide_times = sorted(slide_times)
-    
-    def get_slide(time):
-        if time < slide_times[0]:
-            return 0
-        for i in range(len(slide_times) - 1):
-            if time >= slide_times[i] and time < slide_times[i + 1]:
-                return i + 1
-        return len(slide_times)
-    
-    new_rows = []
-    for idx, row in events_df.iterrows():
-        event_start = row['start_time']
-        event_end = row['end_time']
-        start_slide = get_slide(event_start)
-        end_slide = get_slide(event_end)
-        
-        # If the event is entirely within one slide, assign slide number.
-        if start_slide == end_slide:
-            row_copy = row.copy()
-            row_copy['duration'] = event_end - event_start
-            row_copy['slide'] = start_slide  # added slide number for single-slide events
-            new_rows.append(row_copy)
-        else:
-            # The event spans one or more slide boundaries.
-            boundaries = [t for t in slide_times if event_start < t < event_end]
-            segments = [event_start] + boundaries + [event_end]
-            for j in range(len(segments) - 1):
-                seg_start = segments[j]
-                seg_end = segments[j + 1]
-                mid = (seg_start + seg_end) / 2.0
-                seg_slide = get_slide(mid)
-                new_row = row.copy()
-                new_row['start_time'] = seg_start
-                new_row['end_time'] = seg_end
-                new_row['duration'] = seg_end - seg_start
-                new_row['slide'] = seg_slide
-                new_rows.append(new_row)
-    
-    return pd.DataFrame(new_rows)
+    slide_times = np.sort(np.asarray(slide_times, dtype=float))
+
+    if len(events_df) == 0:
+        return pd.DataFrame()
+
+    event_start = events_df['start_time'].to_numpy(dtype=float)
+    event_end = events_df['end_time'].to_numpy(dtype=float)
+
+    # Slide boundaries strictly inside each event are slide_times[first_boundary:first_boundary + n_boundaries]
+    first_boundary = np.searchsorted(slide_times, event_start, side='right')
+    n_boundaries = np.searchsorted(slide_times, event_end, side='left') - first_boundary
+    n_boundaries[(n_boundaries < 0) | np.isnan(event_start) | np.isnan(event_end)] = 0
+
+    # Every event becomes n_boundaries + 1 segments
+    n_segments = n_boundaries + 1
+    rows = np.repeat(np.arange(len(events_df)), n_segments)
+    segment_offsets = np.cumsum(n_segments) - n_segments
+    position = np.arange(len(rows)) - np.repeat(segment_offsets, n_segments)
+
+    seg_first_boundary = first_boundary[rows]
+    is_first = position == 0
+    is_last = position == n_segments[rows] - 1
+
+    # Padding keeps the boundary lookups in range, the padded values are never selected
+    padded_times = np.append(slide_times, np.inf)
+    start_index = np.clip(seg_first_boundary + position - 1, 0, len(slide_times))
+    end_index = np.clip(seg_first_boundary + position, 0, len(slide_times))
+    seg_start = np.where(is_first, event_start[rows], padded_times[start_index])
+    seg_end = np.where(is_last, event_end[rows], padded_times[end_index])
+
+    # A segment belongs to the slide its midpoint falls in
+    seg_slide = np.searchsorted(slide_times, (seg_start + seg_end) / 2.0, side='right')
+
+    new_df = events_df.iloc[rows].copy()
+    new_df['start_time'] = seg_start
+    new_df['end_time'] = seg_end
+    new_df['duration'] = seg_end - seg_start
+    new_df['slide'] = seg_slide
+
+    # Rows of an all-numeric log share one dtype, which used to carry over to every output column
+    dtypes = list(events_df.dtypes)
+    if all(isinstance(dtype, np.dtype) and dtype.kind in 'iuf' for dtype in dtypes):
+        new_df = new_df.astype(np.result_type(*dtypes, np.float64))
+    return new_df
 
 def split_by_slides(blink_df, gaze_df, user_inputs_df):
     """
@@ -145,51 +174,110 @@ def split_by_slides(blink_df, gaze_df, user_inputs_df):
     
     return blink_df, gaze_df'''
     
-def process_data(video_file, user_inputs_file, output_folder, EAR, shape_predictor="shape_predictor_68_face_landmarks.dat"):
+def process_data(video_file, user_inputs_file, output_folder, EAR, shape_predictor="shape_predictor_68_face_landmarks.dat", workers=1,
+                 log_format='csv', prefetch_depth=0, use_feature_store=False, face_options=None, prefork=False, profile=False,
+                 trace_file=None):
     os.makedirs(output_folder, exist_ok=True)
     
     base_name = os.path.splitext(os.path.basename(video_file))[0]
-    run_blink_gaze_tracker(video_file, user_inputs_file, output_folder, base_name, EAR, shape_predictor)
+    return run_blink_gaze_tracker(video_file, user_inputs_file, output_folder, base_name, EAR, shape_predictor, workers, log_format,
+                                  prefetch_depth, use_feature_store, face_options, prefork, profile, trace_file)
 
     #if not full_only:
     #    process_split_logs(video_file, user_inputs_file, output_folder)
 
 
+def _flagged_periods(mind_wandering_df):
+    """
+    Returns the rows of the report flagged as mind wandering with their period starts and ends.
+    The open end of the last slide becomes NaN.
+    """
+    flagged = mind_wandering_df[mind_wandering_df['mind_wandering'] == True]
+    periods = flagged['time_period'].tolist()
+    period_start = np.array([period[0] for period in periods], dtype=float)
+    period_end = np.array([period[1] for period in periods], dtype=float)
+    return flagged, period_start, period_end
+
+def _match_reports(report_times, period_start, period_end):
+    """
+    Pairs every report time with the periods containing it (start <= time <= end).
+    Returns the report and period positions, ordered by report then by period.
+    """
+    # periods with a NaN bound never contain a report
+    candidates = np.flatnonzero(~np.isnan(period_start) & ~np.isnan(period_end))
+    order = candidates[np.argsort(period_start[candidates], kind='stable')]
+    starts = period_start[order]
+    ends = period_end[order]
+
+    if np.all(np.diff(ends) >= 0):
+        # slide periods don't nest, so the periods containing a time are one contiguous run order[lo:hi]
+        hi = np.searchsorted(starts, report_times, side='right')
+        lo = np.searchsorted(ends, report_times, side='left')
+        counts = np.maximum(hi - lo, 0)
+        report_idx = np.repeat(np.arange(len(report_times)), counts)
+        offsets = np.cumsum(counts) - counts
+        position = lo[report_idx] + np.arange(len(report_idx)) - offsets[report_idx]
+    else:
+        inside = (starts[None, :] <= report_times[:, None]) & (ends[None, :] >= report_times[:, None])
+        report_idx, position = np.nonzero(inside)
+
+    period_idx = order[position]
+    keep = np.lexsort((period_idx, report_idx))
+    return report_idx[keep], period_idx[keep]
+
 def cross_check_mind_wandering(user_inputs_df, mind_wandering_df):
     """
     Cross-checks the mind wandering flags with user inputs.
+    Returns one entry per user report and flagged slide period containing it.
     """
-    # Extract the mind wandering actions from user inputs
-    # Filter for user-reported mind wandering events.
     mw_user_report = user_inputs_df[user_inputs_df['action'] == 'mind_wandering']
-    
-    #print(mw_user_report)
-    
-    # Filter the computed report for slides flagged as mind-wandering.
-    mw_computed_report = mind_wandering_df[mind_wandering_df['mind_wandering'] == True].copy()
-    #print(mw_computed_report)
-
-    results = []
-    # Iterate over each user-reported event.
-    for _, user_row in mw_user_report.iterrows():
-        user_time = user_row['time']
-        # Find computed entries where the user_time is within the time period.
-        mw_computed_report['time_start'] = mw_computed_report['time_period'].apply(lambda x: x[0])
-        mw_computed_report['time_end'] = mw_computed_report['time_period'].apply(lambda x: x[1])
-
-        #print(mw_computed_report)
-        matches = mw_computed_report[
-            (mw_computed_report['time_start'] <= user_time) & (mw_computed_report['time_end'] >= user_time)
-        ]
-        # If one or more matching computed periods are found:
-        for _, comp_row in matches.iterrows():
-            results.append({
-                'user_time': user_time,
-                'computed_time_start': comp_row['time_start'],
-                'computed_time_end': comp_row['time_end'],
-                'slide': comp_row['slide']
-            })
-    return results
+    user_time = mw_user_report['time'].to_numpy(dtype=float)
+
+    flagged, period_start, period_end = _flagged_periods(mind_wandering_df)
+    slides = flagged['slide'].to_numpy()
+    report_idx, period_idx = _match_reports(user_time, period_start, period_end)
+
+    return [{
+        'user_time': user_time[report],
+        'computed_time_start': period_start[period],
+        'computed_time_end': period_end[period],
+        'slide': slides[period]
+    } for report, period in zip(report_idx, period_idx)]
+
+def mind_wandering_scores(user_inputs_df, mind_wandering_df):
+    """
+    Precision and recall of the mind wandering flags of one session against the user reports.
+    A flagged slide is confirmed if the user reported mind wandering during it,
+    a report is found if it falls in a flagged slide.
+    """
+    user_time = user_inputs_df.loc[user_inputs_df['action'] == 'mind_wandering', 'time'].to_numpy(dtype=float)
+    flagged, period_start, period_end = _flagged_periods(mind_wandering_df)
+    report_idx, period_idx = _match_reports(user_time, period_start, period_end)
+
+    scores = {
+        'reports': len(user_time),
+        'flagged_slides': len(flagged),
+        'found_reports': len(np.unique(report_idx)),
+        'confirmed_slides': len(np.unique(period_idx)),
+    }
+    return _with_rates(scores)
+
+def _with_rates(scores):
+    scores['precision'] = scores['confirmed_slides'] / scores['flagged_slides'] if scores['flagged_slides'] else np.nan
+    scores['recall'] = scores['found_reports'] / scores['reports'] if scores['reports'] else np.nan
+    return scores
+
+def mind_wandering_summary(scores_by_subject):
+    """
+    One row of scores per subject and an 'all' row with the counts of every session pooled
+    """
+    summary = pd.DataFrame.from_dict(scores_by_subject, orient='index')
+    if summary.empty:
+        return summary
+    counts = ['reports', 'flagged_slides', 'found_reports', 'confirmed_slides']
+    summary.loc['all'] = pd.Series(_with_rates({col: int(summary[col].sum()) for col in counts}))
+    summary.index.name = 'subject'
+    return summary
     
     
 from slide import Slides
@@ -203,11 +291,26 @@ if __name__ == "__main__":
     )
     parser.add_argument("-f", "--folder", type=str, required=True, help="Folder with video files and user inputs")
     parser.add_argument("-sp", "--shape_predictor", type=str, default="shape_predictor_68_face_landmarks.dat", help="Path to shape predictor file")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes used to analyze each video")
+    parser.add_argument("-lf", "--log_format", type=str, default="csv", choices=LOG_FORMATS, help="File format of the blink and gaze logs")
+    parser.add_argument("-pd", "--prefetch_depth", type=int, default=0, help="Frames decoded ahead on a reader thread (0 disables prefetching)")
+    parser.add_argument("-fs", "--feature_store", action="store_true", help="Cache per-frame features next to each video and derive the logs from them")
+    parser.add_argument("-pf", "--prefork", action="store_true", help="Fork the workers after loading the models so they share one copy")
+    parser.add_argument("-pr", "--profile", action="store_true", help="Print the time spent in each stage of the frame pipeline (serial runs)")
+    parser.add_argument("-tr", "--trace", action="store_true", help="Save the stage times of every frame next to the logs (implies --profile)")
+    parser.add_argument("-ds", "--detect_scale", type=float, default=1.0, help="Run the face detector on frames resized by this factor (e.g. 0.5)")
+    parser.add_argument("-fr", "--flow_refresh", type=int, default=1, help="Run the shape predictor every N frames and follow the eye landmarks with optical flow in between (1 disables flow)")
     
     args = parser.parse_args()
+    face_options = {}
+    if args.flow_refresh > 1:
+        face_options['flow_refresh'] = args.flow_refresh
+    if args.detect_scale < 1:
+        face_options['detect_scale'] = args.detect_scale
 
     presentation = PresentationHandler("presentation/presentation.pptx")
     word_count = presentation.get_number_of_words_per_slide()
+    scores = {}
     # Loop through video files that follow the naming convention.
     for file_name in os.listdir(args.folder):
         if file_name.startswith("video_recording_") and file_name.endswith(".mp4"):
@@ -225,10 +328,11 @@ if __name__ == "__main__":
             if os.path.exists(user_inputs_file):
                 print(f"Processing subject {subject}...")
                 
-                blink_log_path = os.path.join(output_folder, f"video_recording_{subject}_blink_log.csv")
-                gaze_log_path = os.path.join(output_folder, f"video_recording_{subject}_gaze_log.csv")
-                
-                process_data(video_path, user_inputs_file, output_folder, EAR, shape_predictor=args.shape_predictor)
+                blink_log_path, gaze_log_path = process_data(video_path, user_inputs_file, output_folder, EAR, shape_predictor=args.shape_predictor,
+                                                             workers=args.workers, log_format=args.log_format,
+                                                             prefetch_depth=args.prefetch_depth, use_feature_store=args.feature_store,
+                                                             face_options=face_options, prefork=args.prefork, profile=args.profile,
+                                                             trace_file=os.path.join(output_folder, f"{subject}_stage_trace.csv") if args.trace else None)
                 
                 load_data(blink_log_path, gaze_log_path, user_inputs_file)
 
@@ -236,7 +340,9 @@ if __name__ == "__main__":
                 
                 mind_wandering_df = slides.mind_wandering_report()
 
-                results = cross_check_mind_wandering(pd.read_csv(user_inputs_file), mind_wandering_df)
+                user_inputs_df = pd.read_csv(user_inputs_file)
+                results = cross_check_mind_wandering(user_inputs_df, mind_wandering_df)
+                scores[subject] = mind_wandering_scores(user_inputs_df, mind_wandering_df)
                 
                 print("Mind wanderring detected in the following slides:")
                 mind_wandering_df.to_csv("mind_wandering_report.csv", index=False)
@@ -246,3 +352,9 @@ if __name__ == "__main__":
 
 
                 
+
+    summary = mind_wandering_summary(scores)
+    if not summary.empty:
+        print("Mind wandering precision and recall per subject:")
+        print(summary)
+        summary.to_csv(os.path.join(args.folder, "processed_data", "mind_wandering_scores.csv"))
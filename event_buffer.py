@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+class EventBuffer:
+    """
+    Append-only columnar storage for event logs.
+    Every column is a preallocated NumPy array that doubles when full, so appending
+    a row is O(1) and a DataFrame is only built when asked for.
+    If spill_path is given, every chunk_rows rows are written to disk as an .npz chunk
+    and dropped from memory, which keeps long sessions bounded in memory.
+    """
+
+    def __init__(self, columns, capacity=1024, spill_path=None, chunk_rows=1_000_000):
+        # columns : dict of column name -> numpy dtype, in the order the values are appended
+        self.columns = dict(columns)
+        self.capacity = capacity
+        self.size = 0
+        self.arrays = [np.empty(capacity, dtype=dtype) for dtype in self.columns.values()]
+
+        self.spill_path = spill_path
+        self.chunk_rows = chunk_rows
+        self.chunk_files = []
+        self.spilled_rows = 0
+
+    def __len__(self):
+        return self.spilled_rows + self.size
+
+    def append(self, *values):
+        """
+            Appends one row, values are given in column order
+        """
+        if len(values) != len(self.arrays):
+            raise ValueError(f"Expected {len(self.arrays)} values, got {len(values)}.")
+        if self.size == self.capacity:
+            self._grow()
+
+        for array, value in zip(self.arrays, values):
+            array[self.size] = value
+        self.size += 1
+
+        if self.spill_path is not None and self.size >= self.chunk_rows:
+            self._spill()
+
+    def extend(self, *columns):
+        """
+            Appends many rows at once, one array per column in column order
+        """
+        if len(columns) != len(self.arrays):
+            raise ValueError(f"Expected {len(self.arrays)} columns, got {len(columns)}.")
+        columns = [np.asarray(values) for values in columns]
+        rows = len(columns[0])
+        if any(len(values) != rows for values in columns):
+            raise ValueError("All columns must have the same length.")
+
+        while self.size + rows > self.capacity:
+            self._grow()
+        for array, values in zip(self.arrays, columns):
+            array[self.size:self.size + rows] = values
+        self.size += rows
+
+        if self.spill_path is not None and self.size >= self.chunk_rows:
+            self._spill()
+
+    def _grow(self):
+        self.capacity *= 2
+        for i, array in enumerate(self.arrays):
+            grown = np.empty(self.capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            self.arrays[i] = grown
+
+    def _spill(self):
+        chunk_file = f"{self.spill_path}.{len(self.chunk_files)}.npz"
+        os.makedirs(os.path.dirname(chunk_file) or '.', exist_ok=True)
+        np.savez(chunk_file, **{name: array[:self.size] for name, array in zip(self.columns, self.arrays)})
+
+        self.chunk_files.append(chunk_file)
+        self.spilled_rows += self.size
+        self.size = 0
+
+    def column(self, name):
+        """
+            Returns a whole column (spilled chunks included) as one array
+        """
+        index = list(self.columns).index(name)
+        # only object columns (e.g. key names) are pickled in the chunks
+        allow_pickle = np.dtype(self.columns[name]).kind == 'O'
+        parts = []
+        for chunk_file in self.chunk_files:
+            with np.load(chunk_file, allow_pickle=allow_pickle) as chunk:
+                parts.append(chunk[name])
+        parts.append(self.arrays[index][:self.size])
+        return np.concatenate(parts) if len(parts) > 1 else parts[0].copy()
+
+    def to_dataframe(self):
+        return pd.DataFrame({name: self.column(name) for name in self.columns})
+
+    def clear(self):
+        """
+            Drops all rows and deletes the spilled chunks
+        """
+        for chunk_file in self.chunk_files:
+            if os.path.exists(chunk_file):
+                os.remove(chunk_file)
+        self.chunk_files = []
+        self.spilled_rows = 0
+        self.size = 0
@@ -1,12 +1,14 @@
 import numpy as np
 import cv2 
-import math
 
+from eye_geometry import eye_bounding_box, eye_center, single_eye_aspect_ratio
 from pupil import Pupil
+from profiling import NULL_PROFILER
 
 class Eye:
-    def __init__(self, original_frame, landmarks, threshold):
+    def __init__(self, original_frame, landmarks, threshold, pupil_backend='contours', profiler=NULL_PROFILER):
         # right_eye : bool - will determine right eye or left 
+        # pupil_backend : str - Pupil backend, 'fast' skips the pupil search when the eye is closed
         self.landmark_points = None 
         self.frame = None 
         self.center = None
@@ -14,6 +16,8 @@ class Eye:
         self.ear = None
         self.origin = None
         self.threshold = threshold
+        self.pupil_backend = pupil_backend
+        self.profiler = profiler
 
         if original_frame is not None and landmarks is not None:
             self._analyze(original_frame, landmarks)
@@ -28,21 +32,16 @@ class Eye:
         region = landmarks_points
         region = region.astype(np.int32)
 
-   
-        height, width = frame.shape[:2]
-        mask = np.full((height, width), 255, np.uint8)
-        cv2.fillPoly(mask, [region], (0, 0, 0))
-        mask = cv2.bitwise_not(mask)
-        eye = cv2.bitwise_and(frame, frame, mask=mask)
-
-        # Cropping the eye
+        # Cropping the eye first, clamped to the frame, so only the crop gets masked
         margin = 10 # five pixel ofset
-        min_x = np.min(region[:, 0]) - margin
-        max_x = np.max(region[:, 0]) + margin
-        min_y = np.min(region[:, 1]) - margin
-        max_y = np.max(region[:, 1]) + margin
+        min_x, min_y, max_x, max_y = (int(v) for v in eye_bounding_box(region, margin, frame.shape))
+
+        roi = frame[min_y:max_y, min_x:max_x]
+        mask = np.zeros(roi.shape[:2], np.uint8)
+        cv2.fillPoly(mask, [region - np.array([min_x, min_y], np.int32)], 255)
 
-        self.frame = eye[min_y:max_y, min_x:max_x]
+        # bitwise_and writes a new array, so the crop doesn't keep the frame alive
+        self.frame = cv2.bitwise_and(roi, roi, mask=mask)
         self.origin = [min_x,min_y]
 
         
@@ -50,12 +49,19 @@ class Eye:
         #method will determine what eye and will isolate the frame
 
         self.landmark_points = landmarks
+        start = self.profiler.clock()
         self._isolate(original_frame, landmarks)
+        self.profiler.record('eye_isolation', start)
+
+        start = self.profiler.clock()
         self.ear = self._calculate_EAR(self.landmark_points)
         self.center = self._eye_center(self.landmark_points)
+        self.profiler.record('ear', start)
 
-
-        self.pupil = Pupil(self.frame)
+        start = self.profiler.clock()
+        eye_closed = self.threshold is not None and self.ear <= self.threshold
+        self.pupil = Pupil(self.frame, backend=self.pupil_backend, eye_closed=eye_closed)
+        self.profiler.record('pupil', start)
     
     def pupils_detected(self):
         return (self.pupil.x is not None
@@ -66,19 +72,9 @@ class Eye:
     '''
     @staticmethod
     def _calculate_EAR(landmark_points):
-        if len(landmark_points) != 6:
-            raise ValueError(f"Expected 6 eye landmarks, got {len(landmark_points)}.")
-        
-        p = landmark_points
-
-        a = math.hypot(p[1][0] - p[5][0], p[1][1] - p[5][1])
-        b = math.hypot(p[2][0] - p[4][0], p[2][1] - p[4][1])
-        c = math.hypot(p[0][0] - p[3][0], p[0][1] - p[3][1])
-        
-        ear = (a + b)/ (2*c)
-        return ear
+        return float(single_eye_aspect_ratio(landmark_points))
     
     @staticmethod
     def _eye_center(landmarks):
         # center will be (0,0) for me and of the pupil located there the person is looking strate
-        return landmarks.mean(axis=0)
\ No newline at end of file
+        return eye_center(landmarks)
\ No newline at end of file
@@ -0,0 +1,90 @@
+import math
+import numpy as np
+
+# 68 point dlib landmarks of the eyes
+LEFT_EYE = slice(36, 42)
+RIGHT_EYE = slice(42, 48)
+
+
+def _distance(p, q):
+    return np.hypot(p[..., 0] - q[..., 0], p[..., 1] - q[..., 1])
+
+
+def eye_aspect_ratio(eye_points):
+    """
+        EAR of (..., 6, 2) eye landmarks, returns an array of shape (...)
+    """
+    p = np.asarray(eye_points, dtype=float)
+    if p.shape[-2:] != (6, 2):
+        raise ValueError(f"Expected 6 eye landmarks, got shape {p.shape}.")
+
+    a = _distance(p[..., 1, :], p[..., 5, :])
+    b = _distance(p[..., 2, :], p[..., 4, :])
+    c = _distance(p[..., 0, :], p[..., 3, :])
+    return (a + b) / (2 * c)
+
+
+def single_eye_aspect_ratio(p):
+    """
+        EAR of one eye's 6 landmarks with scalar math, much cheaper than eye_aspect_ratio
+        for a single eye per frame. eye_aspect_ratio is for batches.
+    """
+    if len(p) != 6:
+        raise ValueError(f"Expected 6 eye landmarks, got {len(p)}.")
+
+    a = math.hypot(p[1][0] - p[5][0], p[1][1] - p[5][1])
+    b = math.hypot(p[2][0] - p[4][0], p[2][1] - p[4][1])
+    c = math.hypot(p[0][0] - p[3][0], p[0][1] - p[3][1])
+    return (a + b) / (2 * c)
+
+
+def eye_center(eye_points):
+    """
+        Mean point of (..., 6, 2) eye landmarks
+    """
+    return np.asarray(eye_points).mean(axis=-2)
+
+
+def eye_bounding_box(eye_points, margin=0, frame_shape=None):
+    """
+        (min_x, min_y, max_x, max_y) of (..., 6, 2) eye landmarks grown by margin,
+        clamped to the frame if frame_shape is given
+    """
+    points = np.asarray(eye_points).astype(np.int32)
+    box = np.concatenate([points.min(axis=-2) - margin, points.max(axis=-2) + margin], axis=-1)
+    if frame_shape is not None:
+        height, width = frame_shape[:2]
+        box = np.clip(box, 0, [width, height, width, height])
+    return box
+
+
+def _eye_points(landmarks):
+    """
+        Splits (..., 68, 2) face landmarks or (..., 12, 2) eye landmarks into (..., 2, 6, 2), left eye first
+    """
+    landmarks = np.asarray(landmarks)
+    if landmarks.shape[-2] == 68:
+        eyes = landmarks[..., LEFT_EYE.start:RIGHT_EYE.stop, :]
+    elif landmarks.shape[-2] == 12:
+        eyes = landmarks
+    else:
+        raise ValueError(f"Expected 68 face or 12 eye landmarks, got shape {landmarks.shape}.")
+    return eyes.reshape(eyes.shape[:-2] + (2, 6, 2))
+
+
+def eye_geometry(landmarks, margin=0, frame_shape=None):
+    """
+        EAR, center and bounding box of both eyes in one call.
+        landmarks : (68, 2) or (N, 68, 2) face landmarks, or (12, 2) / (N, 12, 2) eye landmarks
+        Returns a dict of left_/right_ ear, center and bbox arrays with a leading N axis for batched input.
+    """
+    eyes = _eye_points(landmarks)
+    ear = eye_aspect_ratio(eyes)
+    center = eye_center(eyes)
+    bbox = eye_bounding_box(eyes, margin, frame_shape)
+
+    return {
+        'left_ear': ear[..., 0], 'right_ear': ear[..., 1],
+        'left_center': center[..., 0, :], 'right_center': center[..., 1, :],
+        'left_bbox': bbox[..., 0, :], 'right_bbox': bbox[..., 1, :]
+    }
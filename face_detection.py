@@ -3,21 +3,87 @@ import dlib
 import cv2
 import numpy as np
 
+import model_registry
 from eye import Eye
+from eye_geometry import LEFT_EYE, RIGHT_EYE, single_eye_aspect_ratio
+from pupil import PUPIL_BACKENDS
+from profiling import NULL_PROFILER
+
+# landmark points 36-47, both eyes
+EYE_POINTS = slice(LEFT_EYE.start, RIGHT_EYE.stop)
 
 class Face:
-    def __init__(self, shape_predictor_path):
+    def __init__(self, shape_predictor_path, detect_every=1, search_margin=0.2, grayscale=False, pupil_backend='contours',
+                 flow_refresh=1, flow_max_error=12.0, flow_max_ear_jump=0.05, detect_scale=1.0, upsample_fallback=False):
+        """
+            detect_every : int - run the full HOG detector every N frames (1 = every frame).
+                In between, the face box is carried forward from the last landmarks, placed around them
+                the way the detector placed its box around the landmarks of the last detection.
+            search_margin : float - fraction of the face box the landmarks may move out of the carried box
+                before tracking counts as lost.
+            grayscale : bool - isolate the eyes and find the pupils on the grayscale frame
+                used for dlib instead of the BGR frame. Color is then only used for overlays.
+            pupil_backend : str - 'contours' or 'fast', see Pupil. With 'fast' and an EAR threshold set,
+                closed eyes get no pupil position.
+            flow_refresh : int - run the shape predictor every K frames (1 = every frame).
+                In between, the eye landmarks are moved with Lucas-Kanade optical flow.
+            flow_max_error : float - largest flow error accepted for an eye landmark.
+            flow_max_ear_jump : float - largest EAR change from the previous frame accepted from the flow,
+                a bigger change (e.g. a blink) runs the shape predictor again.
+            detect_scale : float - run the face detector on a copy of the frame resized by this factor
+                (e.g. 0.25-0.5), the face box is scaled back up for the shape predictor on the full frame.
+                When no face is found the detector runs again at full resolution.
+            upsample_fallback : bool - when the full resolution detector finds no face either,
+                try once more with the frame upsampled by dlib.
+        """
         if not cv2.os.path.isfile(shape_predictor_path):
             raise FileNotFoundError(f"Shape predictor file not found at {shape_predictor_path}.")
+        if detect_every < 1:
+            raise ValueError(f"detect_every must be at least 1, got {detect_every}.")
+        if not 0 < detect_scale <= 1:
+            raise ValueError(f"detect_scale must be in (0, 1], got {detect_scale}.")
+        if flow_refresh < 1:
+            raise ValueError(f"flow_refresh must be at least 1, got {flow_refresh}.")
+        if pupil_backend not in PUPIL_BACKENDS:
+            raise ValueError(f"Unknown pupil backend {pupil_backend}, expected one of {PUPIL_BACKENDS}.")
 
         self.shape_predictor_path = shape_predictor_path
-        self.detector = dlib.get_frontal_face_detector()
-        self.predictor = dlib.shape_predictor(self.shape_predictor_path)
+        # loaded once per process and shared by all Face instances
+        self.detector = model_registry.get_detector()
+        self.predictor = model_registry.get_predictor(self.shape_predictor_path)
         self.frame = None
+        self.gray = None
+        self.grayscale = grayscale
+        self.pupil_backend = pupil_backend
+        # set to a profiling.StageProfiler to time the stages of refresh()
+        self.profiler = NULL_PROFILER
 
         self.right_eye = None
         self.left_eye = None
         self.threshold = None
+
+        # face tracking between full detections
+        self.detect_every = detect_every
+        self.search_margin = search_margin
+        self.face_rect = None
+        self.box_fit = None
+        self.frames_since_detection = 0
+        self.detection_stats = {'frames': 0, 'full_detections': 0, 'tracked': 0, 'tracking_lost': 0, 'flow': 0, 'flow_lost': 0,
+                                'scale_fallbacks': 0, 'upsampled': 0}
+
+        # downscaled face detection
+        self.detect_scale = detect_scale
+        self.upsample_fallback = upsample_fallback
+
+        # optical flow of the eye landmarks between shape predictor runs
+        self.flow_refresh = flow_refresh
+        self.flow_max_error = flow_max_error
+        self.flow_max_ear_jump = flow_max_ear_jump
+        self.landmarks = None
+        self.previous_gray = None
+        self.frames_since_prediction = 0
+        # how the landmarks of the last frame were found: 'detector', 'tracked' or 'flow'
+        self.landmark_path = None
         
     def _analyze(self):
         """
@@ -27,23 +93,227 @@ class Face:
         #cv2.imshow("frame", self.frame)
         if self.frame is None or self.frame.size == 0:
             return
-        gray = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
-        faces = self.detector(gray,0)
-        if len(faces) == 0:
-            raise ValueError("No face detected")
-
-        face = faces[0]
-        landmarks = self.predictor(gray, face)
-        landmarks = face_utils.shape_to_np(landmarks)
+        gray = self.gray
+        if gray is None:
+            start = self.profiler.clock()
+            gray = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+            self.profiler.record('grayscale', start)
+        landmarks = self._locate_landmarks(gray)
 
         left_eye = landmarks[36:42] 
         right_eye = landmarks[42:48]
+        eye_frame = gray if self.grayscale else self.frame
         
-        self.left_eye = Eye(original_frame=self.frame, landmarks=left_eye, threshold=self.threshold)
-        self.right_eye = Eye( original_frame=self.frame, landmarks=right_eye, threshold=self.threshold)
+        self.left_eye = Eye(original_frame=eye_frame, landmarks=left_eye, threshold=self.threshold, pupil_backend=self.pupil_backend,
+                            profiler=self.profiler)
+        self.right_eye = Eye( original_frame=eye_frame, landmarks=right_eye, threshold=self.threshold, pupil_backend=self.pupil_backend,
+                             profiler=self.profiler)
+
+    def _locate_landmarks(self, gray):
+        """
+            Returns the 68 face landmarks. Between shape predictor runs the eye landmarks
+            are moved with optical flow, the other points are kept from the last prediction.
+        """
+        self.detection_stats['frames'] += 1
+
+        if self._flow_active(gray):
+            start = self.profiler.clock()
+            eye_points = self._flow_eye_points(gray)
+            self.profiler.record('landmark_flow', start)
+            if eye_points is not None:
+                self.detection_stats['flow'] += 1
+                self.frames_since_prediction += 1
+                self.landmarks = self.landmarks.copy()
+                self.landmarks[EYE_POINTS] = eye_points
+                self.previous_gray = gray
+                self.landmark_path = 'flow'
+                return self.landmarks
+            self.detection_stats['flow_lost'] += 1
+
+        try:
+            landmarks = self._predict_landmarks(gray)
+        except ValueError:
+            self.landmarks = None
+            self.previous_gray = None
+            raise
+        self.frames_since_prediction = 1
+        self.landmarks = landmarks
+        self.previous_gray = gray
+        return landmarks
+
+    def _predict_landmarks(self, gray):
+        """
+            Runs the shape predictor, using the tracked face box when possible
+            and falling back to the full detector every N frames or when tracking is lost.
+        """
+        if self._tracking_active():
+            start = self.profiler.clock()
+            landmarks = face_utils.shape_to_np(self.predictor(gray, self.face_rect))
+            self.profiler.record('landmark_prediction', start)
+            if self._tracking_holds(landmarks):
+                self.detection_stats['tracked'] += 1
+                self.frames_since_detection += 1
+                self.face_rect = self._rect_from_landmarks(landmarks, gray.shape)
+                self.landmark_path = 'tracked'
+                return landmarks
+            self.detection_stats['tracking_lost'] += 1
+
+        self.detection_stats['full_detections'] += 1
+        start = self.profiler.clock()
+        faces = self._detect_faces(gray)
+        self.profiler.record('hog_detection', start)
+        if len(faces) == 0:
+            self.face_rect = None
+            self.landmark_path = None
+            raise ValueError("No face detected")
+
+        start = self.profiler.clock()
+        landmarks = face_utils.shape_to_np(self.predictor(gray, faces[0]))
+        self.profiler.record('landmark_prediction', start)
+        self.frames_since_detection = 1
+        self.box_fit = self._fit_box(faces[0], landmarks)
+        self.face_rect = self._rect_from_landmarks(landmarks, gray.shape)
+        self.landmark_path = 'detector'
+        return landmarks
+
+    def _detect_faces(self, gray):
+        """
+            Runs the face detector at detect_scale, then at full resolution
+            and upsampled (if enabled) while no face is found
+        """
+        if self.detect_scale < 1:
+            small = cv2.resize(gray, None, fx=self.detect_scale, fy=self.detect_scale, interpolation=cv2.INTER_AREA)
+            faces = self.detector(small, 0)
+            if len(faces) > 0:
+                return [self._scale_rect(face, 1 / self.detect_scale, gray.shape) for face in faces]
+            self.detection_stats['scale_fallbacks'] += 1
+
+        faces = self.detector(gray, 0)
+        if len(faces) == 0 and self.upsample_fallback:
+            self.detection_stats['upsampled'] += 1
+            faces = self.detector(gray, 1)
+        return faces
+
+    @staticmethod
+    def _scale_rect(rect, factor, frame_shape):
+        height, width = frame_shape[:2]
+        return dlib.rectangle(
+            int(max(round(rect.left() * factor), 0)),
+            int(max(round(rect.top() * factor), 0)),
+            int(min(round(rect.right() * factor), width - 1)),
+            int(min(round(rect.bottom() * factor), height - 1)))
+
+    def _flow_active(self, gray):
+        return (self.flow_refresh > 1
+            and self.landmarks is not None
+            and self.previous_gray is not None
+            and self.previous_gray.shape == gray.shape
+            and self.frames_since_prediction < self.flow_refresh)
+
+    def _flow_eye_points(self, gray):
+        """
+            Moves the 12 eye landmarks from the previous frame with pyramidal Lucas-Kanade flow.
+            Returns None if a point was lost, its error is too big or the EAR jumped.
+        """
+        previous_points = self.landmarks[EYE_POINTS]
+        points, status, error = cv2.calcOpticalFlowPyrLK(
+            self.previous_gray, gray, previous_points.astype(np.float32).reshape(-1, 1, 2), None,
+            winSize=(15, 15), maxLevel=2)
+        if points is None or not status.all() or error.max() > self.flow_max_error:
+            return None
+
+        points = np.rint(points.reshape(-1, 2)).astype(previous_points.dtype)
+        for eye in (slice(0, 6), slice(6, 12)):
+            if abs(single_eye_aspect_ratio(points[eye]) - single_eye_aspect_ratio(previous_points[eye])) > self.flow_max_ear_jump:
+                return None
+        return points
+
+    def _tracking_active(self):
+        return (self.detect_every > 1
+            and self.face_rect is not None
+            and self.frames_since_detection < self.detect_every)
+
+    def _tracking_holds(self, landmarks):
+        """
+            Tracking is lost when the new landmarks collapse or drift out of the carried box.
+        """
+        rect = self.face_rect
+        min_x, min_y = landmarks.min(axis=0)
+        max_x, max_y = landmarks.max(axis=0)
+        area = (max_x - min_x) * (max_y - min_y)
+        if area <= 0:
+            return False
+
+        margin_x = rect.width() * self.search_margin
+        margin_y = rect.height() * self.search_margin
+        if (min_x < rect.left() - margin_x or max_x > rect.right() + margin_x
+                or min_y < rect.top() - margin_y or max_y > rect.bottom() + margin_y):
+            return False
+
+        # a face that shrank to less than half of the landmark share of the box at detection is treated as lost
+        return area / (rect.width() * rect.height()) >= self.box_fit[4] / 2
+
+    @staticmethod
+    def _fit_box(rect, landmarks):
+        """
+            Returns the sides of the detector box relative to the landmark bounding box
+            (left, top, right, bottom in landmark box widths/heights) and the landmark share of the box area
+        """
+        min_x, min_y = landmarks.min(axis=0)
+        max_x, max_y = landmarks.max(axis=0)
+        width, height = max(max_x - min_x, 1), max(max_y - min_y, 1)
+        return ((rect.left() - min_x) / width, (rect.top() - min_y) / height,
+                (rect.right() - max_x) / width, (rect.bottom() - max_y) / height,
+                width * height / max(rect.width() * rect.height(), 1))
+
+    def _rect_from_landmarks(self, landmarks, frame_shape):
+        """
+            Places a box around the landmarks with the geometry of the last detector box,
+            so the shape predictor sees the same face framing as after a full detection
+        """
+        height, width = frame_shape[:2]
+        min_x, min_y = landmarks.min(axis=0)
+        max_x, max_y = landmarks.max(axis=0)
+        face_w, face_h = max(max_x - min_x, 1), max(max_y - min_y, 1)
+        left, top, right, bottom, _ = self.box_fit
 
-    def refresh(self, frame):
+        return dlib.rectangle(
+            int(max(round(min_x + left * face_w), 0)),
+            int(max(round(min_y + top * face_h), 0)),
+            int(min(round(max_x + right * face_w), width - 1)),
+            int(min(round(max_y + bottom * face_h), height - 1)))
+
+    def reset_tracking(self):
+        """
+            Forgets the tracked face box and landmarks, e.g. before analyzing another video
+        """
+        self.face_rect = None
+        self.box_fit = None
+        self.frames_since_detection = 0
+        self.landmarks = None
+        self.previous_gray = None
+        self.frames_since_prediction = 0
+
+    def detection_fallback_rate(self):
+        """
+            Returns the share of frames that ran the full face detector
+        """
+        frames = self.detection_stats['frames']
+        return self.detection_stats['full_detections'] / frames if frames else 0
+
+    def flow_rate(self):
+        """
+            Returns the share of frames whose eye landmarks came from optical flow
+        """
+        frames = self.detection_stats['frames']
+        return self.detection_stats['flow'] / frames if frames else 0
+
+    def refresh(self, frame, gray=None):
+        """
+            gray : optional grayscale copy of frame, e.g. converted ahead by the frame reader
+        """
         self.frame = frame
+        self.gray = gray
         self._analyze()
 
     def set_ear_threshold(self, threshold):
@@ -101,10 +371,6 @@ class Face:
             print("Error: Eyes not detected in highlight_landmarks()")
             return self.frame  # Return original frame instead of None
         
-        if not self.left_eye.pupils_detected() or not self.right_eye.pupils_detected():
-            print("Error: Pupils not detected")
-            return self.frame
-        
         frame_with_landmarks = self.frame.copy()
 
         for (x, y) in self.left_eye.landmark_points:
@@ -113,11 +379,11 @@ class Face:
         for (x, y) in self.right_eye.landmark_points:
             cv2.circle(frame_with_landmarks, (x, y), 1, (0, 255, 0), -1)
 
-        left_pupil_pos = (self.left_eye.origin[0] + self.left_eye.pupil.x, self.left_eye.origin[1] + self.left_eye.pupil.y)
-        right_pupil_pos = (self.right_eye.origin[0] + self.right_eye.pupil.x, self.right_eye.origin[1] + self.right_eye.pupil.y)
-
-        cv2.circle(frame_with_landmarks, left_pupil_pos, 2, (0, 0, 255), -1)
-        cv2.circle(frame_with_landmarks, right_pupil_pos, 2, (0, 0, 255), -1)
+        # pupils are missing for closed eyes or when the pupil search is off (pupil_backend 'none')
+        for eye in (self.left_eye, self.right_eye):
+            if eye.pupils_detected():
+                pupil_pos = (eye.origin[0] + eye.pupil.x, eye.origin[1] + eye.pupil.y)
+                cv2.circle(frame_with_landmarks, pupil_pos, 2, (0, 0, 255), -1)
 
         return frame_with_landmarks
 
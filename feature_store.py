@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+from eye_geometry import eye_geometry
+from frame_pipeline import frame_times_file
+
+# Threshold-independent values of one analyzed frame. Pupil positions are in eye crop
+# coordinates and NaN when the pupil wasn't found, rows with face_found False carry no values.
+# The eye landmarks (points 36-41 and 42-47) allow recomputing the eye geometry offline,
+# landmark_path is the index in LANDMARK_PATHS of how Face found the landmarks.
+FEATURE_DTYPE = np.dtype([
+    ('frame', 'i4'),
+    ('timestamp', 'f8'),
+    ('face_found', '?'),
+    ('left_ear', 'f8'),
+    ('right_ear', 'f8'),
+    ('left_pupil_x', 'f4'),
+    ('left_pupil_y', 'f4'),
+    ('right_pupil_x', 'f4'),
+    ('right_pupil_y', 'f4'),
+    ('left_eye_h', 'i2'),
+    ('left_eye_w', 'i2'),
+    ('right_eye_h', 'i2'),
+    ('right_eye_w', 'i2'),
+    ('left_eye_landmarks', 'i2', (6, 2)),
+    ('right_eye_landmarks', 'i2', (6, 2)),
+    ('landmark_path', 'i1')
+])
+
+LANDMARK_PATHS = (None, 'detector', 'tracked', 'flow')
+
+
+def face_features(frame_num, timestamp, face):
+    """
+        Returns the feature row of a frame, face is the refreshed Face or None if no face was found
+    """
+    if face is None:
+        return (frame_num, timestamp, False, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0, 0, 0, 0,
+                np.zeros((6, 2)), np.zeros((6, 2)), 0)
+
+    left_eye, right_eye = face.left_eye, face.right_eye
+    left_h, left_w = left_eye.frame.shape[:2]
+    right_h, right_w = right_eye.frame.shape[:2]
+    left_x, left_y = (left_eye.pupil.x, left_eye.pupil.y) if left_eye.pupils_detected() else (np.nan, np.nan)
+    right_x, right_y = (right_eye.pupil.x, right_eye.pupil.y) if right_eye.pupils_detected() else (np.nan, np.nan)
+
+    return (frame_num, timestamp, True, left_eye.ear, right_eye.ear,
+            left_x, left_y, right_x, right_y,
+            left_h, left_w, right_h, right_w,
+            left_eye.landmark_points, right_eye.landmark_points,
+            LANDMARK_PATHS.index(face.landmark_path))
+
+
+def session_geometry(features):
+    """
+        Recomputes the EAR, center and bounding box of both eyes for every stored frame
+        in one batched call, frames without a face get NaN
+    """
+    landmarks = np.concatenate([features['left_eye_landmarks'], features['right_eye_landmarks']], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        geometry = eye_geometry(landmarks)
+    missing = ~np.asarray(features['face_found'], dtype=bool)
+    for name, values in geometry.items():
+        values = values.astype(float)
+        values[missing] = np.nan
+        geometry[name] = values
+    return geometry
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FeatureStore:
+    """
+    Memory-mapped per-frame features of one video, stored next to the video in
+    {video name}_features/{key}.npy with a {key}.json metadata file.
+    The key combines the video content hash, the frame times file hash (the timestamps are stored in the rows),
+    the row layout, the shape predictor path and the Face options, so blink and gaze logs can be derived
+    again for any EAR threshold without decoding the video.
+    Only stores of a complete analysis are kept.
+    """
+
+    def __init__(self, video_path, shape_predictor_path, face_options=None, cache_dir=None):
+        self.video_path = video_path
+        self.cache_dir = cache_dir or f"{os.path.splitext(video_path)[0]}_features"
+
+        frame_times = frame_times_file(video_path)
+        key_source = json.dumps({
+            'video': file_hash(video_path),
+            'frame_times': file_hash(frame_times) if os.path.exists(frame_times) else 'absent',
+            'layout': str(FEATURE_DTYPE.descr),
+            'shape_predictor': os.path.abspath(shape_predictor_path),
+            'face_options': face_options or {}
+        }, sort_keys=True)
+        self.key = hashlib.sha1(key_source.encode()).hexdigest()[:16]
+
+        self.path = os.path.join(self.cache_dir, f"{self.key}.npy")
+        self.meta_path = os.path.join(self.cache_dir, f"{self.key}.json")
+        self.features = None
+        self.rows = 0
+
+    def exists(self):
+        if not os.path.exists(self.path) or not os.path.exists(self.meta_path):
+            return False
+        with open(self.meta_path) as f:
+            return json.load(f).get('complete', False)
+
+    def create(self, n_frames):
+        """
+            Opens a new store for up to n_frames rows, it becomes visible once close() is called
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.features = np.lib.format.open_memmap(self.path + '.tmp', mode='w+', dtype=FEATURE_DTYPE, shape=(max(n_frames, 1),))
+        self.rows = 0
+
+    def record(self, row):
+        if self.rows == len(self.features):
+            raise ValueError(f"Feature store is full ({self.rows} rows).")
+        self.features[self.rows] = row
+        self.rows += 1
+
+    def record_many(self, rows):
+        rows = np.asarray(rows, dtype=FEATURE_DTYPE)
+        if self.rows + len(rows) > len(self.features):
+            raise ValueError(f"Feature store is full ({self.rows} rows).")
+        self.features[self.rows:self.rows + len(rows)] = rows
+        self.rows += len(rows)
+
+    def close(self, fps, complete=True):
+        """
+            Makes the store visible, an incomplete analysis (complete=False) is discarded instead
+        """
+        if not complete:
+            self.discard()
+            return
+        self.features.flush()
+        self.features = None
+        os.replace(self.path + '.tmp', self.path)
+        with open(self.meta_path, 'w') as f:
+            json.dump({'rows': self.rows, 'fps': fps, 'video': os.path.basename(self.video_path), 'complete': True}, f)
+
+    def discard(self):
+        """
+            Drops the store being written
+        """
+        self.features = None
+        if os.path.exists(self.path + '.tmp'):
+            os.remove(self.path + '.tmp')
+
+    def load(self):
+        """
+            Returns the stored features as a read-only memory-mapped array
+        """
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        if not meta.get('complete', False):
+            raise ValueError(f"{self.path} holds an incomplete analysis.")
+        return np.load(self.path, mmap_mode='r')[:meta['rows']]
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+def central_difference_velocity(positions, times):
+    """
+        Velocity of the gaze position with central differences for interior points,
+        the first and last point copy their neighbour. Points with dt == 0 get velocity 0.
+    """
+    positions = np.asarray(positions, dtype=float)
+    times = np.asarray(times, dtype=float)
+
+    velocity = np.zeros(len(positions))
+    if len(positions) > 2:
+        dt = times[2:] - times[:-2]
+        dx = positions[2:] - positions[:-2]
+        np.divide(dx, dt, out=velocity[1:-1], where=dt != 0)
+
+    # Handle the boundaries (e.g., using forward/backward difference)
+    if len(velocity) > 1:
+        velocity[0] = velocity[1]
+        velocity[-1] = velocity[-2]
+    return velocity
+
+
+def fixation_runs(times, velocity, velocity_threshold):
+    """
+        Splits the samples into fixations (runs where |velocity| < velocity_threshold).
+        Returns the duration of every fixation and its average velocity, which is taken
+        over the run and the sample that ends it (NaN velocities are skipped).
+    """
+    times = np.asarray(times, dtype=float)
+    velocity = np.asarray(velocity, dtype=float)
+    n = len(velocity)
+
+    fixation = np.abs(velocity) < velocity_threshold
+    # run starts where the mask turns on, run ends (exclusive) where it turns off
+    edges = np.diff(np.concatenate(([False], fixation, [False])).astype(np.int8))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+
+    if len(run_starts) == 0:
+        return np.array([]), np.array([])
+
+    fixation_duration = times[run_ends - 1] - times[run_starts]
+
+    # the average window includes the first non-fixation sample after the run
+    window_ends = np.minimum(run_ends + 1, n)
+    valid = ~np.isnan(velocity)
+    # a trailing 0 keeps every reduceat index in range
+    values = np.append(np.where(valid, velocity, 0.0), 0.0)
+    counts = np.append(valid, False).astype(np.int64)
+    bounds = np.empty(2 * len(run_starts), dtype=np.int64)
+    bounds[0::2] = run_starts
+    bounds[1::2] = window_ends
+    sums = np.add.reduceat(values, bounds)[0::2]
+    sample_counts = np.add.reduceat(counts, bounds)[0::2]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_velocity = sums / sample_counts
+    return fixation_duration, avg_velocity
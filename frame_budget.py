@@ -0,0 +1,145 @@
+# Quality levels from full analysis down to the cheapest one, each level keeps the savings of the ones before it
+QUALITY_LEVELS = ('full', 'cheap_detection', 'no_pupil', 'reduced_rate')
+
+
+class FrameBudget:
+    """
+    Load shedding for live analysis. The load of every analyzed frame is compared with a
+    latency budget. While the smoothed load stays over budget the quality level goes up one
+    step at a time: a cheaper face detection scale, then no pupil search, then analyzing only
+    every 2nd, 3rd, ... frame. Once the load drops well below the budget it steps back down.
+    The load is the capture to result latency of the frame when it is known, so time spent waiting
+    in a queue counts. Otherwise it is the analysis time spread over the captured frames, so
+    skipping frames at the 'reduced_rate' level lowers it as well.
+    """
+
+    def __init__(self, target_ms=33.0, cheap_detect_scale=0.5, max_frame_step=4, smoothing=0.2, patience=10,
+                 recover_ratio=0.6):
+        """
+            target_ms : float - latency budget of one analyzed frame
+            cheap_detect_scale : float - Face.detect_scale used from the 'cheap_detection' level on
+            max_frame_step : int - at most every N-th frame is analyzed at the 'reduced_rate' level
+            smoothing : float - weight of the newest frame in the smoothed load
+            patience : int - analyzed frames between two level changes
+            recover_ratio : float - the level goes down once the smoothed load is below this share of the budget
+        """
+        self.target = target_ms / 1000
+        self.cheap_detect_scale = cheap_detect_scale
+        self.max_frame_step = max_frame_step
+        self.smoothing = smoothing
+        self.patience = patience
+        self.recover_ratio = recover_ratio
+
+        self.level = 0
+        self.frame_step = 1
+        self.smoothed = None
+        self.frames_since_change = 0
+        self.frame_num = 0
+        self.stats = {'frames': 0, 'skipped': 0, 'level_changes': 0}
+        self.frames_per_level = dict.fromkeys(QUALITY_LEVELS, 0)
+
+        self._face_defaults = None
+        self._applied = None
+
+    @property
+    def quality(self):
+        return QUALITY_LEVELS[self.level]
+
+    def should_analyze(self, keep_rate=False):
+        """
+            Call once per captured frame, returns False for frames skipped at the 'reduced_rate' level.
+            keep_rate : bool - analyze the frame even at the 'reduced_rate' level
+        """
+        analyze = keep_rate or self.frame_num % self.frame_step == 0
+        self.frame_num += 1
+        self.stats['frames'] += 1
+        if not analyze:
+            self.stats['skipped'] += 1
+        return analyze
+
+    def apply(self, face, keep_pupil=False):
+        """
+            Configures the Face for the current quality level.
+            keep_pupil : bool - keep the pupil search at the 'no_pupil' level and above
+        """
+        if self._face_defaults is None:
+            self._face_defaults = (face.detect_scale, face.pupil_backend)
+        detect_scale, pupil_backend = self._face_defaults
+        level = min(self.level, 1) if keep_pupil else self.level
+        face.detect_scale = min(detect_scale, self.cheap_detect_scale) if level >= 1 else detect_scale
+        face.pupil_backend = 'none' if level >= 2 else pupil_backend
+        self._applied = QUALITY_LEVELS[level]
+
+    def record(self, seconds, latency=None):
+        """
+            Records the analysis time of a frame and changes the quality level if needed.
+            latency : float - seconds from the capture (or submission) of the frame to its result
+            Returns the quality level the frame was analyzed at.
+        """
+        quality = self._applied or self.quality
+        self._applied = None
+        self.frames_per_level[quality] += 1
+        load = latency if latency is not None else seconds / self.frame_step
+        self.smoothed = load if self.smoothed is None else self.smoothing * load + (1 - self.smoothing) * self.smoothed
+        self.frames_since_change += 1
+
+        if self.frames_since_change >= self.patience:
+            if self.smoothed > self.target:
+                self._shed()
+            elif self.smoothed < self.target * self.recover_ratio:
+                self._restore()
+        return quality
+
+    def _shed(self):
+        if self.level < len(QUALITY_LEVELS) - 1:
+            self.level += 1
+        elif self.frame_step < self.max_frame_step:
+            self.frame_step += 1
+        else:
+            return
+        if self.level == len(QUALITY_LEVELS) - 1:
+            self.frame_step = max(self.frame_step, 2)
+        self._changed()
+
+    def _restore(self):
+        if self.frame_step > 2:
+            self.frame_step -= 1
+        elif self.level > 0:
+            self.level -= 1
+            self.frame_step = 1
+        else:
+            return
+        self._changed()
+
+    def _changed(self):
+        self.frames_since_change = 0
+        self.stats['level_changes'] += 1
+
+    def report(self):
+        analyzed = sum(self.frames_per_level.values())
+        levels = ", ".join(f"{name} {count}" for name, count in self.frames_per_level.items())
+        return (f"Frame budget {self.target * 1000:.0f} ms: {analyzed} of {self.stats['frames']} frames analyzed "
+                f"({levels}), {self.stats['level_changes']} level changes")
+
+
+if __name__ == "__main__":
+    # Self-check: an overload in the middle of a 30 fps stream has to raise the level,
+    # and the level has to come back to 'full' once the load is gone again
+    cost = {'full': 1.0, 'cheap_detection': 0.5, 'no_pupil': 0.35, 'reduced_rate': 0.35}
+    interval = 1 / 30
+    for with_latency in (False, True):
+        budget = FrameBudget(target_ms=33.0)
+        busy_until, highest = 0.0, 0
+        for frame_num in range(3000):
+            if not budget.should_analyze():
+                continue
+            # a single worker, frames queue up behind it while it is busy
+            captured = frame_num * interval
+            seconds = (0.12 if 600 <= frame_num < 1500 else 0.015) * cost[budget.quality]
+            busy_until = max(busy_until, captured) + seconds
+            budget.record(seconds, busy_until - captured if with_latency else None)
+            highest = max(highest, budget.level)
+        signal = 'latency' if with_latency else 'analysis time'
+        assert highest == len(QUALITY_LEVELS) - 1, f"{signal}: the overload only reached {QUALITY_LEVELS[highest]}"
+        assert budget.quality == 'full', f"{signal}: still at {budget.quality} after the overload"
+        print(f"{signal}: {budget.report()}")
@@ -0,0 +1,262 @@
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+import pandas as pd
+
+from event_buffer import EventBuffer
+
+
+def frame_times_file(video_path):
+    """
+        Path of the CSV next to a recording with the capture timestamp of every encoded frame
+    """
+    return f"{os.path.splitext(video_path)[0]}_frame_times.csv"
+
+
+def frame_timestamps(video_path, total_frames, fps):
+    """
+        Timestamps of the frames of a video, taken from its frame times file when it has one
+        and frame_num / fps otherwise
+    """
+    timestamps = np.arange(total_frames) * (1 / fps)
+    path = frame_times_file(video_path) if isinstance(video_path, str) else None
+    if path is None or not os.path.exists(path):
+        return timestamps
+
+    recorded = pd.read_csv(path)['timestamp'].to_numpy(dtype=float)
+    n = min(len(recorded), total_frames)
+    if n == 0:
+        return timestamps
+    if len(recorded) != total_frames:
+        print(f"Warning: {path} has {len(recorded)} frame times for {total_frames} frames.")
+    timestamps[:n] = recorded[:n]
+    # frames the file doesn't cover continue at the nominal frame rate
+    timestamps[n:] = recorded[n - 1] + np.arange(1, total_frames - n + 1) * (1 / fps)
+    return timestamps
+
+
+class FramePrefetcher:
+    """
+    Decodes frames from a cv2.VideoCapture on a reader thread into a bounded queue,
+    so decoding overlaps with the analysis of earlier frames.
+    The counters tell which side is the bottleneck: the queue running empty means the
+    analysis waited for decode, the queue running full means decode waited for the analysis.
+    """
+
+    def __init__(self, cap, depth=8, grayscale=False, max_frames=None):
+        self.cap = cap
+        self.grayscale = grayscale
+        self.max_frames = max_frames
+        self.queue = queue.Queue(maxsize=depth)
+        self.stats = {'frames': 0, 'queue_empty': 0, 'queue_full': 0}
+
+        self._stop_event = threading.Event()
+        self._finished = False
+        # an exception of the reader thread, raised again by read()
+        self._error = None
+        self._thread = threading.Thread(target=self._read_frames, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _read_frames(self):
+        frame_num = 0
+        try:
+            while not self._stop_event.is_set() and (self.max_frames is None or frame_num < self.max_frames):
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if self.grayscale else None
+                if not self._put((frame, gray)):
+                    return
+                frame_num += 1
+        except BaseException as e:
+            self._error = e
+        finally:
+            # end of stream marker, also after an error so read() never waits forever
+            self._put(None)
+
+    def _put(self, item):
+        if self.queue.full():
+            self.stats['queue_full'] += 1
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(self):
+        """
+            Returns ret, frame, gray (gray is None unless grayscale=True), like cap.read()
+        """
+        if self._finished:
+            return False, None, None
+        if self.queue.empty():
+            self.stats['queue_empty'] += 1
+        item = self.queue.get()
+        if item is None:
+            self._finished = True
+            if self._error is not None:
+                raise self._error
+            return False, None, None
+
+        self.stats['frames'] += 1
+        frame, gray = item
+        return True, frame, gray
+
+    def stop(self):
+        self._stop_event.set()
+        # unblock the reader if it waits on a full queue
+        while not self.queue.empty():
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self._thread.join()
+
+    def bottleneck(self):
+        if self.stats['queue_empty'] > self.stats['queue_full']:
+            return 'decode'
+        return 'analysis'
+
+    def report(self):
+        return (f"Prefetch: {self.stats['frames']} frames, queue ran empty {self.stats['queue_empty']} times, "
+                f"full {self.stats['queue_full']} times (bottleneck: {self.bottleneck()})")
+
+
+class LatestFrameSlot:
+    """
+    Hands the newest frame from a producer thread to a consumer thread.
+    A frame that wasn't taken yet is replaced by the next one, so a slow consumer
+    always works on the latest frame and never holds the producer back.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self.closed = False
+        self.stats = {'put': 0, 'taken': 0, 'dropped': 0}
+
+    def put(self, frame, timestamp=None):
+        with self._condition:
+            if self._item is not None:
+                self.stats['dropped'] += 1
+            self._item = (frame, timestamp)
+            self.stats['put'] += 1
+            self._condition.notify()
+
+    def take(self, timeout=None):
+        """
+            Returns the newest (frame, timestamp), or None on timeout or once the slot is closed
+        """
+        with self._condition:
+            if self._item is None and not self.closed:
+                self._condition.wait(timeout)
+            if self._item is None:
+                return None
+            item, self._item = self._item, None
+            self.stats['taken'] += 1
+            return item
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def report(self):
+        return (f"Latest frame slot: {self.stats['put']} frames put, {self.stats['taken']} taken, "
+                f"{self.stats['dropped']} dropped as stale")
+
+
+class AsyncVideoWriter:
+    """
+    Encodes frames with a cv2.VideoWriter on its own thread, fed through a bounded queue,
+    so encoding stalls don't add to the capture latency.
+    policy decides what write() does when the queue is full: 'block' waits for space,
+    'drop' drops the frame and 'report' waits like 'block' and prints how long capture stalled.
+    The timestamp of every encoded frame is saved next to the video (see frame_times_file),
+    so the recording stays frame accurate even when frames were dropped.
+    """
+
+    POLICIES = ('block', 'drop', 'report')
+
+    def __init__(self, output_file, fourcc, fps, frame_size, depth=64, policy='block'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown write policy {policy}, expected one of {self.POLICIES}.")
+        self.writer = cv2.VideoWriter(output_file, fourcc, fps, frame_size)
+        self.frame_times_path = frame_times_file(output_file)
+        self.frame_times = EventBuffer({'frame': 'i8', 'timestamp': 'f8'})
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=depth)
+        self.stats = {'submitted': 0, 'frames': 0, 'dropped': 0, 'blocked': 0, 'blocked_time': 0.0,
+                      'encode_time': 0.0, 'max_encode_time': 0.0, 'queue_depth_total': 0, 'max_queue_depth': 0}
+
+        self._thread = threading.Thread(target=self._encode_frames, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def write(self, frame, timestamp):
+        """
+            Queues a frame for encoding, returns False if it was dropped
+        """
+        depth = self.queue.qsize()
+        self.stats['submitted'] += 1
+        self.stats['queue_depth_total'] += depth
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], depth)
+
+        try:
+            self.queue.put_nowait((frame, timestamp))
+            return True
+        except queue.Full:
+            if self.policy == 'drop':
+                self.stats['dropped'] += 1
+                return False
+
+        start = time.perf_counter()
+        self.queue.put((frame, timestamp))
+        waited = time.perf_counter() - start
+        self.stats['blocked'] += 1
+        self.stats['blocked_time'] += waited
+        if self.policy == 'report':
+            print(f"[WARNING] Encoder queue full, capture stalled {waited * 1000:.1f} ms at {timestamp:.3f}s")
+        return True
+
+    def _encode_frames(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame, timestamp = item
+            start = time.perf_counter()
+            self.writer.write(frame)
+            encode_time = time.perf_counter() - start
+
+            self.frame_times.append(self.stats['frames'], timestamp)
+            self.stats['frames'] += 1
+            self.stats['encode_time'] += encode_time
+            self.stats['max_encode_time'] = max(self.stats['max_encode_time'], encode_time)
+
+    def close(self):
+        """
+            Encodes the queued frames, releases the writer and saves the frame times
+        """
+        self.queue.put(None)
+        self._thread.join()
+        self.writer.release()
+        self.frame_times.to_dataframe().to_csv(self.frame_times_path, index=False)
+
+    def report(self):
+        frames = max(self.stats['frames'], 1)
+        submitted = max(self.stats['submitted'], 1)
+        return (f"Encoder: {self.stats['frames']} frames written, {self.stats['dropped']} dropped, "
+                f"{self.stats['blocked']} blocked writes ({self.stats['blocked_time']:.2f}s), "
+                f"encode {self.stats['encode_time'] / frames * 1000:.1f} ms/frame (max {self.stats['max_encode_time'] * 1000:.1f} ms), "
+                f"queue depth mean {self.stats['queue_depth_total'] / submitted:.1f} max {self.stats['max_queue_depth']}")
@@ -0,0 +1,280 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+from event_buffer import EventBuffer
+from face_detection import Face
+from frame_budget import FrameBudget, QUALITY_LEVELS
+from feature_store import FEATURE_DTYPE, face_features
+from blink_gaze_tracker import observation_from_features
+
+
+class SharedFrameRing:
+    """
+    Fixed number of equally sized uint8 frames in one multiprocessing.shared_memory block.
+    The capturing process creates it, the analysis processes attach to it by name.
+    """
+
+    def __init__(self, frame_shape, slots, name=None):
+        self.frame_shape = tuple(frame_shape)
+        self.slots = slots
+        size = slots * int(np.prod(self.frame_shape))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            try:
+                # only the creator unlinks the block (track is Python 3.13+)
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.frames = np.ndarray((slots,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def close(self):
+        # the array view has to go before the shared memory can be closed
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _analysis_worker(index, ring_name, frame_shape, slots, shape_predictor_path, face_options, ear_threshold,
+                     frame_budget_ms, tasks, results, free_slots, in_flight):
+    """
+        Analysis process: takes (frame_num, slot, timestamp, submitted_at) tasks, analyzes the frame in the slot,
+        hands the slot back and sends the feature row of the frame with the quality level it was analyzed at.
+        in_flight holds the frame number and slot the worker is on (-1 when none), so the collector can
+        recover them if the process gets killed.
+        A None task stops the worker. A worker that returns always ends with its index as result.
+    """
+    ring, face = None, None
+    budget = FrameBudget(frame_budget_ms) if frame_budget_ms else None
+    try:
+        ring = SharedFrameRing(frame_shape, slots, ring_name)
+        face = Face(shape_predictor_path, **face_options)
+        face.set_ear_threshold(ear_threshold)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            frame_num, slot, timestamp, submitted_at = task
+            in_flight[0], in_flight[1] = frame_num, slot
+            if budget is not None and not budget.should_analyze():
+                # logged like a frame without a face, the logger repeats the last observation
+                row, quality = face_features(frame_num, timestamp, None), 'skipped'
+            else:
+                if budget is not None:
+                    budget.apply(face)
+                start = time.perf_counter()
+                try:
+                    face.refresh(ring.frames[slot])
+                    row = face_features(frame_num, timestamp, face)
+                except Exception:
+                    # the collector feeds the logger in frame order, so a failed frame still needs its row
+                    row = face_features(frame_num, timestamp, None)
+                if budget is not None:
+                    # time.monotonic is one clock for all processes, the latency includes the wait in the queue
+                    quality = budget.record(time.perf_counter() - start, time.monotonic() - submitted_at)
+                else:
+                    quality = QUALITY_LEVELS[0]
+            # the row holds no reference to the frame, so the slot can be reused right away
+            face.frame = None
+            free_slots.put(slot)
+            in_flight[1] = -1
+            results.put((row, quality))
+            in_flight[0] = -1
+    except Exception as e:
+        print(f"Analysis worker {os.getpid()} stopped: {e}")
+    finally:
+        face = None
+        if ring is not None:
+            ring.close()
+        results.put(index)
+
+
+class SharedMemoryAnalyzer:
+    """
+    Live analysis in worker processes. Captured frames are copied into a SharedFrameRing and
+    only the slot index and timestamp are sent to the workers, so frames are never pickled.
+    The feature rows come back in any order and are fed to the FrameLogger in frame order
+    by a collector thread.
+    With drop_when_full a frame is dropped when every slot is busy, otherwise submit() waits for a free slot.
+    Every worker sees only every N-th frame, so face and landmark tracking between frames
+    (detect_every, flow_refresh) is turned off in the workers.
+    With frame_budget_ms every worker sheds analysis quality (see FrameBudget) while its frames
+    take longer than that from submission to result. The level of every frame, and 'dropped'
+    for the frames submit() dropped, is kept in frame_quality (see quality_log).
+    A worker that dies without finishing (killed, out of memory, crashed in native code) is noticed
+    by the collector, its frame is logged without a face and counted as lost.
+    """
+
+    # seconds between liveness checks of the workers while no result comes in
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, shape_predictor_path, frame_shape, logger, workers=2, slots=None, face_options=None,
+                 ear_threshold=None, drop_when_full=True, frame_budget_ms=None):
+        self.shape_predictor_path = shape_predictor_path
+        self.frame_shape = tuple(frame_shape)
+        self.logger = logger
+        self.workers = workers
+        self.slots = slots or 4 * workers
+        self.face_options = {**(face_options or {}), 'detect_every': 1, 'flow_refresh': 1}
+        self.ear_threshold = ear_threshold
+        self.drop_when_full = drop_when_full
+        self.frame_budget_ms = frame_budget_ms
+        self.stats = {'submitted': 0, 'dropped': 0, 'analyzed': 0, 'lost': 0, 'max_reorder': 0}
+        self.frame_quality = EventBuffer({'time': 'f8', 'quality': object}, capacity=256)
+        # submit() and the collector thread both append to frame_quality
+        self._quality_lock = threading.Lock()
+
+        self.ring = None
+        self.processes = []
+        self.in_flight = []
+        self._timestamps = {}
+        self._collector = None
+
+    def start(self):
+        # the capturing process already runs several threads, forking it could copy a held lock
+        context = multiprocessing.get_context('spawn')
+        self.ring = SharedFrameRing(self.frame_shape, self.slots)
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.free_slots = context.Queue()
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+
+        for index in range(self.workers):
+            in_flight = context.Array('q', [-1, -1], lock=False)
+            process = context.Process(target=_analysis_worker, daemon=True, args=(
+                index, self.ring.name, self.frame_shape, self.slots, self.shape_predictor_path, self.face_options,
+                self.ear_threshold, self.frame_budget_ms, self.tasks, self.results, self.free_slots, in_flight))
+            process.start()
+            self.processes.append(process)
+            self.in_flight.append(in_flight)
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def submit(self, frame, timestamp):
+        """
+            Hands a frame to the workers, returns False if it was dropped
+        """
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Expected a frame of shape {self.frame_shape}, got {frame.shape}.")
+        try:
+            slot = self.free_slots.get(block=not self.drop_when_full)
+        except queue.Empty:
+            self.stats['dropped'] += 1
+            with self._quality_lock:
+                self.frame_quality.append(timestamp, 'dropped')
+            return False
+
+        self.ring.frames[slot] = frame
+        # kept until the frame is logged, a frame lost with its worker is logged at this time
+        self._timestamps[self.stats['submitted']] = timestamp
+        self.tasks.put((self.stats['submitted'], slot, timestamp, time.monotonic()))
+        self.stats['submitted'] += 1
+        return True
+
+    def _collect(self):
+        pending = {}
+        next_frame = 0
+        finished = set()
+        while len(finished) < self.workers:
+            try:
+                result = self.results.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                self._recover_dead_workers(finished, pending)
+            else:
+                if isinstance(result, int):
+                    finished.add(result)
+                elif result[0][0] >= next_frame:
+                    # a frame already logged as lost stays lost
+                    pending.setdefault(result[0][0], result)
+            self.stats['max_reorder'] = max(self.stats['max_reorder'], len(pending))
+            while next_frame in pending:
+                self._log(pending.pop(next_frame))
+                next_frame += 1
+
+        # frames still queued when the last worker went away were never analyzed
+        for frame_num in range(next_frame, self.stats['submitted']):
+            self._log(pending.pop(frame_num, None) or self._lost(frame_num))
+
+    def _recover_dead_workers(self, finished, pending):
+        """
+            Marks the workers that exited without sending their index as finished,
+            logs their in-flight frame as lost and hands their slot back
+        """
+        for index, process in enumerate(self.processes):
+            if index in finished or process.exitcode is None or process.exitcode == 0:
+                continue
+            finished.add(index)
+            frame_num, slot = self.in_flight[index]
+            print(f"Analysis worker {process.pid} died with exit code {process.exitcode}"
+                  + (f" on frame {frame_num}" if frame_num >= 0 else ""))
+            if slot >= 0:
+                self.free_slots.put(slot)
+            if frame_num >= 0:
+                pending.setdefault(frame_num, self._lost(frame_num))
+
+    def _lost(self, frame_num):
+        self.stats['lost'] += 1
+        return face_features(frame_num, self._timestamps.get(frame_num, 0.0), None), 'lost'
+
+    def _log(self, result):
+        row, quality = result
+        row = np.array(row, dtype=FEATURE_DTYPE)
+        self._timestamps.pop(int(row['frame']), None)
+        self.logger.update(float(row['timestamp']), observation_from_features(row))
+        with self._quality_lock:
+            self.frame_quality.append(float(row['timestamp']), quality)
+        if quality != 'lost':
+            self.stats['analyzed'] += 1
+
+    def stop(self, timeout=10.0):
+        """
+            Lets the workers finish the submitted frames, then stops them and frees the ring.
+            Workers still running after timeout seconds are terminated, their frames are logged as lost.
+        """
+        for _ in self.processes:
+            self.tasks.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                print(f"Analysis worker {process.pid} didn't stop within {timeout:.0f}s, terminating it")
+                process.terminate()
+                process.join()
+        self._collector.join(timeout + self.POLL_INTERVAL)
+        if self._collector.is_alive():
+            print("Result collector didn't finish, some frames were not logged")
+        self.processes = []
+        self.in_flight = []
+        self.ring.close()
+
+    def quality_log(self):
+        """
+            Returns the quality level of every submitted frame as a DataFrame in time order
+        """
+        with self._quality_lock:
+            quality = self.frame_quality.to_dataframe()
+        # dropped frames are logged at submission, ahead of earlier frames still being analyzed
+        return quality.sort_values('time', kind='stable').reset_index(drop=True)
+
+    def report(self):
+        report = (f"Shared memory analysis: {self.stats['submitted']} frames submitted to {self.workers} workers, "
+                  f"{self.stats['analyzed']} analyzed, {self.stats['dropped']} dropped with all {self.slots} slots busy, "
+                  f"{self.stats['lost']} lost with a dead worker, "
+                  f"up to {self.stats['max_reorder']} results waiting for reordering")
+        if self.frame_budget_ms:
+            levels = self.quality_log()['quality'].value_counts()
+            report += f", frames per quality level within {self.frame_budget_ms:.0f} ms: " + ", ".join(
+                f"{quality} {count}" for quality, count in levels.items())
+        return report
@@ -1,25 +1,58 @@
 import pandas as pd
 import os
 
+from event_buffer import EventBuffer
+from log_io import is_binary_log, save_log
+
 class GazeAnalysis:
-    def __init__(self):
-        self.gaze_df = pd.DataFrame(columns=['left_eye_from_center', 'right_eye_from_center', 'start_time', 'end_time', 'left_eye_dim', 'right_eye_dim'])
+    def __init__(self, spill_path=None):
+        # the eye vectors and dimensions are stored as flat numeric columns
+        self.points = EventBuffer({
+            'left_eye_x' : 'f8',
+            'left_eye_y' : 'f8',
+            'right_eye_x' : 'f8',
+            'right_eye_y' : 'f8',
+            'start_time' : 'f8',
+            'end_time' : 'f8',
+            'left_eye_h' : 'i4',
+            'left_eye_w' : 'i4',
+            'right_eye_h' : 'i4',
+            'right_eye_w' : 'i4'
+        }, spill_path=spill_path)
+
+    @property
+    def gaze_df(self):
+        points = self.points
+        left_x, left_y = points.column('left_eye_x').tolist(), points.column('left_eye_y').tolist()
+        right_x, right_y = points.column('right_eye_x').tolist(), points.column('right_eye_y').tolist()
+        left_h, left_w = points.column('left_eye_h').tolist(), points.column('left_eye_w').tolist()
+        right_h, right_w = points.column('right_eye_h').tolist(), points.column('right_eye_w').tolist()
+
+        return pd.DataFrame({
+            'left_eye_from_center' : [[x, y] for x, y in zip(left_x, left_y)],
+            'right_eye_from_center' : [[x, y] for x, y in zip(right_x, right_y)],
+            'start_time' : points.column('start_time'),
+            'end_time' : points.column('end_time'),
+            'left_eye_dim' : list(zip(left_h, left_w)),
+            'right_eye_dim' : list(zip(right_h, right_w))
+        }, columns=['left_eye_from_center', 'right_eye_from_center', 'start_time', 'end_time', 'left_eye_dim', 'right_eye_dim'])
 
     def add_point(self, left_eye, right_eye, time_start, time_end, left_eye_dim, right_eye_dim):
         if left_eye is None or right_eye is None:
             return
-        new_point = pd.Series({
-            'left_eye_from_center' : left_eye,
-            'right_eye_from_center' : right_eye,
-            'start_time' : time_start,
-            'end_time' : time_end,
-            'left_eye_dim' : left_eye_dim,
-            'right_eye_dim' : right_eye_dim
-        })
+        self.points.append(
+            left_eye[0], left_eye[1],
+            right_eye[0], right_eye[1],
+            time_start, time_end,
+            left_eye_dim[0], left_eye_dim[1],
+            right_eye_dim[0], right_eye_dim[1]
+        )
 
-        self.gaze_df = pd.concat([self.gaze_df, new_point.to_frame().T], ignore_index=True)
-    
     def save_data(self, file_name):
+        # binary logs keep the flat columns, CSV logs keep the list/tuple columns
+        if is_binary_log(file_name):
+            save_log(self.points.to_dataframe(), file_name)
+            return
         if not file_name.endswith('.csv'):
             file_name += '.csv'
         file_path = os.path.join(file_name)
@@ -0,0 +1,65 @@
+import argparse
+import sys
+import time
+import cv2
+
+from face_detection import Face
+
+
+def pupil_positions(face):
+    return [(eye.pupil.x, eye.pupil.y) for eye in (face.left_eye, face.right_eye)]
+
+
+def check_video(video_path, shape_predictor_path, max_frames=None):
+    """
+        Runs the BGR and the grayscale eye path on the same frames and
+        returns frames compared, mismatching frames and the time spent in each path
+    """
+    bgr_face = Face(shape_predictor_path)
+    gray_face = Face(shape_predictor_path, grayscale=True)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video {video_path}.")
+
+    compared, mismatches = 0, []
+    timings = {'bgr': 0.0, 'grayscale': 0.0}
+    frame_num = 0
+    while max_frames is None or frame_num < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        try:
+            start = time.perf_counter()
+            bgr_face.refresh(frame, gray)
+            timings['bgr'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            gray_face.refresh(frame, gray)
+            timings['grayscale'] += time.perf_counter() - start
+        except ValueError:
+            frame_num += 1
+            continue
+
+        compared += 1
+        if pupil_positions(bgr_face) != pupil_positions(gray_face):
+            mismatches.append((frame_num, pupil_positions(bgr_face), pupil_positions(gray_face)))
+        frame_num += 1
+
+    cap.release()
+    return compared, mismatches, timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the grayscale eye path finds the same pupils as the BGR path")
+    parser.add_argument("video", help="Video file to check")
+    parser.add_argument("-sp", "--shape_predictor", type=str, default="shape_predictor_68_face_landmarks.dat", help="Path to shape predictor file")
+    parser.add_argument("-n", "--max_frames", type=int, default=None, help="Only check the first N frames")
+    args = parser.parse_args()
+
+    compared, mismatches, timings = check_video(args.video, args.shape_predictor, args.max_frames)
+    print(f"{compared} frames with a face compared, {len(mismatches)} mismatches")
+    print(f"BGR path: {timings['bgr']:.3f}s, grayscale path: {timings['grayscale']:.3f}s")
+    for frame_num, bgr, gray in mismatches[:10]:
+        print(f"frame {frame_num}: BGR {bgr} grayscale {gray}")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,112 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Binary logs keep one flat numeric column per value. .npz only needs numpy,
+# .parquet and .feather go through pandas and need pyarrow installed.
+BINARY_EXTENSIONS = ('.npz', '.parquet', '.feather')
+LOG_FORMATS = ('csv', 'npz', 'parquet', 'feather')
+
+# Narrower dtypes used for the binary formats, the eye offsets are half pixels
+# so float32 holds them exactly
+COMPACT_DTYPES = {
+    'left_eye_x': 'f4',
+    'left_eye_y': 'f4',
+    'right_eye_x': 'f4',
+    'right_eye_y': 'f4',
+    'left_eye_h': 'i2',
+    'left_eye_w': 'i2',
+    'right_eye_h': 'i2',
+    'right_eye_w': 'i2',
+    'slide': 'i4'
+}
+
+
+def log_file_name(file_name, log_format='csv'):
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format {log_format}, expected one of {LOG_FORMATS}.")
+    return f"{file_name}.{log_format}"
+
+
+def is_binary_log(path):
+    return os.path.splitext(path)[1] in BINARY_EXTENSIONS
+
+
+def _compact(df):
+    df = df.copy()
+    for col, dtype in COMPACT_DTYPES.items():
+        if col not in df.columns:
+            continue
+        values = df[col].to_numpy()
+        if np.dtype(dtype).kind == 'i' and not np.all(np.isfinite(values.astype('f8'))):
+            continue
+        df[col] = values.astype(dtype)
+    return df
+
+
+def save_log(df, path):
+    """
+        Writes a log in the format given by the file extension (.csv, .npz, .parquet or .feather)
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.npz':
+        df = _compact(df)
+        for col in df.columns:
+            if df[col].dtype == object:
+                raise ValueError(f"Column {col} is not numeric and can't be stored in {path}.")
+        np.savez_compressed(path, **{col: df[col].to_numpy() for col in df.columns})
+    elif ext == '.parquet':
+        _compact(df).to_parquet(path, index=False)
+    elif ext == '.feather':
+        _compact(df).reset_index(drop=True).to_feather(path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def read_log(path):
+    """
+        Reads a log written by save_log, any other extension is read as CSV
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.npz':
+        with np.load(path) as data:
+            return pd.DataFrame({col: data[col] for col in data.files})
+    elif ext == '.parquet':
+        return pd.read_parquet(path)
+    elif ext == '.feather':
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
+
+def flatten_gaze_log(gaze_df):
+    """
+        Converts a CSV gaze log with stringified vectors ("[-7.5, -2.0]") and
+        dimensions ("(41, 89)") into the flat numeric columns of the binary logs
+    """
+    gaze_df = gaze_df.copy()
+    pairs = {
+        'left_eye_from_center': ('left_eye_x', 'left_eye_y', 'f8'),
+        'right_eye_from_center': ('right_eye_x', 'right_eye_y', 'f8'),
+        'left_eye_dim': ('left_eye_h', 'left_eye_w', 'i4'),
+        'right_eye_dim': ('right_eye_h', 'right_eye_w', 'i4')
+    }
+    for col, (first, second, dtype) in pairs.items():
+        if col not in gaze_df.columns:
+            continue
+        values = gaze_df[col].astype(str).str.strip('[]() ').str.split(',', expand=True)
+        gaze_df[first] = values[0].astype(float).astype(dtype)
+        gaze_df[second] = values[1].astype(float).astype(dtype)
+        gaze_df = gaze_df.drop(columns=col)
+    return gaze_df
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a CSV blink or gaze log to a binary log")
+    parser.add_argument("source", help="CSV log to convert")
+    parser.add_argument("destination", help="Output log (.npz, .parquet or .feather)")
+    args = parser.parse_args()
+
+    save_log(flatten_gaze_log(read_log(args.source)), args.destination)
+    print(f"{args.source} ({os.path.getsize(args.source)} bytes) -> {args.destination} ({os.path.getsize(args.destination)} bytes)")
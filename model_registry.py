@@ -0,0 +1,60 @@
+"""
+Process wide cache of the dlib models. The face detector and every shape predictor are loaded
+once per process and shared by all Face instances of that process. A worker pool forked after
+the models are loaded inherits them copy-on-write instead of loading its own copy.
+"""
+import os
+import sys
+import time
+import dlib
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_detector = None
+_predictors = {}
+load_stats = {'detector_loads': 0, 'predictor_loads': 0, 'load_time': 0.0}
+
+
+def get_detector():
+    global _detector
+    if _detector is None:
+        start = time.perf_counter()
+        _detector = dlib.get_frontal_face_detector()
+        load_stats['detector_loads'] += 1
+        load_stats['load_time'] += time.perf_counter() - start
+    return _detector
+
+
+def get_predictor(shape_predictor_path):
+    path = os.path.abspath(shape_predictor_path)
+    if path not in _predictors:
+        start = time.perf_counter()
+        _predictors[path] = dlib.shape_predictor(path)
+        load_stats['predictor_loads'] += 1
+        load_stats['load_time'] += time.perf_counter() - start
+    return _predictors[path]
+
+
+def preload(shape_predictor_path):
+    """
+        Loads the detector and the shape predictor now, e.g. before forking workers.
+        Returns the seconds spent loading.
+    """
+    before = load_stats['load_time']
+    get_detector()
+    get_predictor(shape_predictor_path)
+    return load_stats['load_time'] - before
+
+
+def peak_rss_mb():
+    """
+        Peak resident set size of this process in MB (None if unknown), shared copy-on-write pages included
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
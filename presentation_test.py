@@ -1,11 +1,16 @@
 import cv2
 import time
-import pandas as pd
 from pynput import keyboard
 import threading
 import os
 import argparse
 from face_detection import Face
+from event_buffer import EventBuffer
+from frame_pipeline import AsyncVideoWriter, LatestFrameSlot
+from frame_ring import SharedMemoryAnalyzer
+from blink_gaze_tracker import FrameLogger
+from blink_analysis import BlinkAnalysis
+from gaze_analysis import GazeAnalysis
 
 class KeyboardListener:
     def __init__(
@@ -21,7 +26,7 @@ class KeyboardListener:
         KeyboardListener now uses a 'video_time_source' (typically a WebcamRecorder)
         to retrieve the current video time instead of real clock time.
         """
-        self.log_file = pd.DataFrame(columns=['action', 'time', 'slide'])
+        self.log_file = EventBuffer({'action': object, 'time': 'f8', 'slide': 'i4'}, capacity=64)
         self.key_to_track = key_to_track
         self.stop_key = stop_key
         self.stop_event = stop_event
@@ -51,14 +56,7 @@ class KeyboardListener:
             if hasattr(key, 'char') and key.char is not None:
                 if key.char == self.key_to_track:
                     # Mind-wandering key
-                    self.log_file = pd.concat([
-                        self.log_file,
-                        pd.DataFrame({
-                            'action': ['mind_wandering'],
-                            'time': [current_time],
-                            'slide': [self.slide]
-                        })
-                    ])
+                    self.log_file.append('mind_wandering', current_time, self.slide)
 
 
                 elif key.char == self.stop_key:
@@ -67,14 +65,7 @@ class KeyboardListener:
             
             elif key == keyboard.Key.space:
                 # Slide transition
-                self.log_file = pd.concat([
-                    self.log_file,
-                    pd.DataFrame({
-                        'action': ['slide_transition'],
-                        'time': [current_time],
-                        'slide': [self.slide]
-                    })
-                ])
+                self.log_file.append('slide_transition', current_time, self.slide)
                 self.slide += 1
                 if self.slide >= self.number_of_slides:
                     self.stop()
@@ -82,14 +73,7 @@ class KeyboardListener:
         except AttributeError:
             # Handling special keys if needed
             if key == keyboard.Key.space:
-                self.log_file = pd.concat([
-                    self.log_file,
-                    pd.DataFrame({
-                        'action': ['slide_transition'],
-                        'time': [current_time],
-                        'slide': [self.slide]
-                    })
-                ])
+                self.log_file.append('slide_transition', current_time, self.slide)
                 self.slide += 1
                 if self.slide >= self.number_of_slides:
                     self.stop()
@@ -105,20 +89,35 @@ class KeyboardListener:
         if self.stop_event:
             self.stop_event.set()
         os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
-        self.log_file.to_csv(self.file_name, index=False)
+        self.log_file.to_dataframe().to_csv(self.file_name, index=False)
         print(f"[DEBUG] Keyboard log saved to {self.file_name}")
         if self.listener:
             self.listener.stop()
 
 class WebcamRecorder:
-    def __init__(self, output_file, source, stop_event):
+    def __init__(self, output_file, source, stop_event, face_options=None, write_queue=64, write_policy='block',
+                 analysis_workers=0, ear_threshold=None, frame_budget_ms=None):
         self.output_file = output_file
         self.source = source
         self.stop_event = stop_event
-        self.face_detector = Face(shape_predictor_path)
+        # face_options are passed on to Face, e.g. {'flow_refresh': 5}
+        self.face_options = face_options or {}
+        self.face_detector = Face(shape_predictor_path, **self.face_options)
         
         self.recording_started = False
         self.latest_frame = None
+        # capture hands frames to the overlay analysis through this slot, stale frames are dropped
+        self.frame_slot = LatestFrameSlot()
+        # frames are encoded on their own thread, see AsyncVideoWriter for the policies
+        self.write_queue = write_queue
+        self.write_policy = write_policy
+        # analysis_workers > 0 logs blinks and gaze live, in that many processes fed through shared memory
+        self.analysis_workers = analysis_workers
+        self.ear_threshold = ear_threshold
+        self.blink_log = None
+        self.gaze_log = None
+        # with a frame budget the live analysis workers shed quality when they fall behind
+        self.frame_budget_ms = frame_budget_ms
         self.current_video_time = 0  # We'll update this each frame
         self.fps = 60  # default, or overwritten once we read from camera
 
@@ -127,7 +126,8 @@ class WebcamRecorder:
     def get_current_video_time(self):
         """
         Returns the current video time in seconds,
-        computed as frame_count / fps in 'start_recording()'.
+        measured from the first captured frame in 'start_recording()'.
+        The same timestamps are saved for every frame of the video.
         """
         return self.current_video_time
 
@@ -160,9 +160,13 @@ class WebcamRecorder:
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
         frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        out = cv2.VideoWriter(self.output_file, fourcc, self.fps, (frame_width, frame_height))
+        out = AsyncVideoWriter(self.output_file, fourcc, self.fps, (frame_width, frame_height),
+                               depth=self.write_queue, policy=self.write_policy).start()
 
-        frame_count = 0
+        capture_start = None
+        live_analyzer = None
+        analysis_thread = threading.Thread(target=self.analyze_frames, daemon=True)
+        analysis_thread.start()
 
         while not self.stop_event.is_set():
             ret, frame = cap.read()
@@ -171,18 +175,58 @@ class WebcamRecorder:
                 time.sleep(0.1)
                 continue
 
-            # Update current video time: total frames so far / fps
-            self.current_video_time = frame_count / self.fps
-            frame_count += 1
+            # Update current video time: seconds since the first captured frame
+            if capture_start is None:
+                capture_start = time.perf_counter()
+            self.current_video_time = time.perf_counter() - capture_start
 
-            highlighted_frame = self.show_highlighted_face(frame)
-            self.latest_frame = highlighted_frame
-            out.write(frame)
+            if live_analyzer is None and self.analysis_workers > 0:
+                live_analyzer = self.start_live_analysis(frame.shape)
+            if live_analyzer is not None:
+                live_analyzer.submit(frame, self.current_video_time)
 
+            self.frame_slot.put(frame, self.current_video_time)
+            out.write(frame, self.current_video_time)
+
+        self.frame_slot.close()
+        analysis_thread.join()
         cap.release()
-        out.release()
+        out.close()
+        print(f"[DEBUG] {out.report()}")
+        print(f"[DEBUG] {self.frame_slot.report()}")
+        if live_analyzer is not None:
+            live_analyzer.stop()
+            print(f"[DEBUG] {live_analyzer.report()}")
+            base_name = os.path.splitext(self.output_file)[0]
+            self.blink_log.save_data(f"{base_name}_live_blink_log.csv")
+            self.gaze_log.save_data(f"{base_name}_live_gaze_log.csv")
+            if self.frame_budget_ms:
+                live_analyzer.quality_log().to_csv(f"{base_name}_live_quality.csv", index=False)
         print("[DEBUG] Webcam recording stopped.")
 
+    def start_live_analysis(self, frame_shape):
+        """
+        Starts the analysis processes, their results are logged in frame order to the live blink and gaze logs.
+        """
+        self.blink_log = BlinkAnalysis()
+        self.gaze_log = GazeAnalysis()
+        logger = FrameLogger(self.blink_log, self.gaze_log, self.ear_threshold)
+        return SharedMemoryAnalyzer(shape_predictor_path, frame_shape, logger, workers=self.analysis_workers,
+                                    face_options=self.face_options, ear_threshold=self.ear_threshold,
+                                    frame_budget_ms=self.frame_budget_ms).start()
+
+    def analyze_frames(self):
+        """
+        Overlay worker: draws the landmarks on the latest captured frame, frames captured
+        while it was busy are skipped so the analysis never slows down the capture.
+        """
+        while not self.frame_slot.closed:
+            item = self.frame_slot.take(timeout=0.1)
+            if item is None:
+                continue
+            frame, _ = item
+            self.latest_frame = self.show_highlighted_face(frame)
+
     def show_highlighted_face(self, frame):
         """
         Runs face detection on the current frame, draws landmarks if found.
@@ -211,7 +255,9 @@ def run_check():
     presentation.open_presentation()
     number_of_slides = presentation.get_number_of_slides()
     # Create the WebcamRecorder (this will produce the 'video time')
-    webcam_recorder = WebcamRecorder(output_file=video_file, source=0, stop_event=stop_event)
+    webcam_recorder = WebcamRecorder(output_file=video_file, source=0, stop_event=stop_event, face_options=face_options,
+                                     analysis_workers=args.analysis_workers, ear_threshold=args.ear_threshold,
+                                     frame_budget_ms=args.frame_budget)
     
     # Pass webcam_recorder to KeyboardListener so it can read the same 'video time'
     keyboard_listener = KeyboardListener(
@@ -254,20 +300,28 @@ def run_check():
     
     print("[DEBUG] Recording and logging completed.")
 
-parser = argparse.ArgumentParser(description="Run the recording and processing pipeline.") 
-parser.add_argument("-f", "--folder", type=str, required=True, help="Folder path to save files") 
-parser.add_argument("-s", "--subject", type=str, required=True, help="Test subject name") 
-parser.add_argument("-sp", "--shape_predictor", type=str, required=True, help="Shape predictor file path")
+# analysis processes may import this module again, so only the main process runs the session
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the recording and processing pipeline.") 
+    parser.add_argument("-f", "--folder", type=str, required=True, help="Folder path to save files") 
+    parser.add_argument("-s", "--subject", type=str, required=True, help="Test subject name") 
+    parser.add_argument("-sp", "--shape_predictor", type=str, required=True, help="Shape predictor file path")
+    parser.add_argument("-ds", "--detect_scale", type=float, default=1.0, help="Run the face detector on frames resized by this factor (e.g. 0.5)")
+    parser.add_argument("-aw", "--analysis_workers", type=int, default=0, help="Log blinks and gaze live in this many analysis processes (0 disables live analysis)")
+    parser.add_argument("-ear", "--ear_threshold", type=float, default=None, help="EAR threshold for the live blink log")
+    parser.add_argument("-fb", "--frame_budget", type=float, default=None, help="Per-frame budget in ms of the live analysis workers (with -aw), analysis quality is lowered while it is exceeded")
+    parser.add_argument("-fr", "--flow_refresh", type=int, default=1, help="Run the shape predictor every N frames and follow the eye landmarks with optical flow in between (1 disables flow)")
 
-args = parser.parse_args()
+    args = parser.parse_args()
 
-def get_full_path(folder_path, file_name):
-    return os.path.join(folder_path, file_name)
+    def get_full_path(folder_path, file_name):
+        return os.path.join(folder_path, file_name)
 
-video_file = get_full_path(args.folder, f'video_recording_{args.subject}.mp4')  
-inputs_file = get_full_path(args.folder, f'user_inputs_{args.subject}')
-shape_predictor_path = args.shape_predictor
+    video_file = get_full_path(args.folder, f'video_recording_{args.subject}.mp4')  
+    inputs_file = get_full_path(args.folder, f'user_inputs_{args.subject}')
+    shape_predictor_path = args.shape_predictor
+    face_options = {'flow_refresh': args.flow_refresh, 'detect_scale': args.detect_scale}
 
-run_check()
+    run_check()
 
-#qpython3 presentation_test.py -f data/gabriel -s gabriel1 -shape_predictor shape_predictor_68_face_landmarks.dat
\ No newline at end of file
+    #qpython3 presentation_test.py -f data/gabriel -s gabriel1 -shape_predictor shape_predictor_68_face_landmarks.dat
\ No newline at end of file
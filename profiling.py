@@ -0,0 +1,81 @@
+import time
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+
+class StageProfiler:
+    """
+    Collects the time spent in each stage of the frame pipeline.
+    Code under measurement calls start = profiler.clock() and later profiler.record(stage, start).
+    With a trace_path the stage times of every frame are also saved, one row per frame.
+    """
+
+    enabled = True
+
+    def __init__(self, trace_path=None):
+        self.samples = defaultdict(list)
+        self.trace_path = trace_path
+        self.trace = []
+        self.frame_num = 0
+        self._frame_times = {}
+
+    def clock(self):
+        return time.perf_counter()
+
+    def record(self, stage, start):
+        elapsed = time.perf_counter() - start
+        self.samples[stage].append(elapsed)
+        if self.trace_path is not None:
+            self._frame_times[stage] = self._frame_times.get(stage, 0.0) + elapsed
+
+    def next_frame(self):
+        """
+            Marks the end of a frame for the per-frame trace
+        """
+        if self.trace_path is not None:
+            self.trace.append({'frame': self.frame_num, **self._frame_times})
+            self._frame_times = {}
+        self.frame_num += 1
+
+    def summary(self):
+        """
+            Returns count, mean, p50, p95, p99 (ms) and share of the total time per stage
+        """
+        total = sum(sum(durations) for durations in self.samples.values())
+        rows = []
+        for stage, durations in self.samples.items():
+            durations = np.asarray(durations) * 1000
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+            rows.append({'stage': stage, 'count': len(durations), 'mean_ms': durations.mean(),
+                         'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                         'share': durations.sum() / 1000 / total if total else 0.0})
+        return pd.DataFrame(rows, columns=['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'share'])
+
+    def report(self):
+        summary = self.summary().sort_values('share', ascending=False)
+        return summary.to_string(index=False, float_format=lambda value: f"{value:.3f}")
+
+    def save_trace(self):
+        if self.trace_path is not None:
+            pd.DataFrame(self.trace).to_csv(self.trace_path, index=False)
+
+
+class NullProfiler:
+    """
+    Stand-in used when profiling is off, every call does nothing
+    """
+
+    enabled = False
+
+    def clock(self):
+        return 0.0
+
+    def record(self, stage, start):
+        pass
+
+    def next_frame(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
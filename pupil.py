@@ -2,24 +2,41 @@ import numpy as np
 import cv2
 
 
+PUPIL_BACKENDS = ('contours', 'fast', 'none')
+
+
 class Pupil:
     """
     This class detects the iris of an eye and estimates
     the position of the pupil
     """
 
-    def __init__(self, eye_frame):
+    def __init__(self, eye_frame, backend='contours', eye_closed=False):
+        """
+            backend : 'contours' - two thresholds and the largest contour of the full contour tree
+                      'fast' - one threshold pass and the largest external contour,
+                      empty crops and closed eyes (eye_closed) are skipped
+                      'none' - no pupil search, e.g. when live analysis sheds load
+        """
+        if backend not in PUPIL_BACKENDS:
+            raise ValueError(f"Unknown pupil backend {backend}, expected one of {PUPIL_BACKENDS}.")
         self.iris_frame = None
         self.x = None
         self.y = None
 
-        self.detect_iris(eye_frame)
+        if backend == 'fast':
+            self.detect_iris_fast(eye_frame, eye_closed)
+        elif backend == 'contours':
+            self.detect_iris(eye_frame)
 
     @staticmethod
     def image_processing(eye_frame):
-        """Performs operations on the eye frame to isolate the iris"""
-        # Convert to grayscale
-        eye_frame_gray = cv2.cvtColor(eye_frame, cv2.COLOR_BGR2GRAY)
+        """Performs operations on the eye frame to isolate the iris, the eye frame is BGR or already grayscale"""
+        # Convert to grayscale, a grayscale crop is copied since it gets modified below
+        if eye_frame.ndim == 2:
+            eye_frame_gray = eye_frame.copy()
+        else:
+            eye_frame_gray = cv2.cvtColor(eye_frame, cv2.COLOR_BGR2GRAY)
         
         # Calculate average intensity
         non_black_pixels = eye_frame_gray[eye_frame_gray > 0]
@@ -53,4 +70,41 @@ class Pupil:
             self.x = int(moments['m10'] / moments['m00'])
             self.y = int(moments['m01'] / moments['m00'])
         except (IndexError, ZeroDivisionError):
-            pass
\ No newline at end of file
+            pass
+
+    @staticmethod
+    def image_processing_fast(eye_frame):
+        """Single threshold version of image_processing, returns None if the crop has no eye pixels"""
+        if eye_frame.ndim == 2:
+            eye_frame_gray = eye_frame
+        else:
+            eye_frame_gray = cv2.cvtColor(eye_frame, cv2.COLOR_BGR2GRAY)
+
+        non_black_pixels = eye_frame_gray[eye_frame_gray > 0]
+        if non_black_pixels.size == 0:
+            return None
+        threshold = np.mean(non_black_pixels) + 10
+
+        # above avg and above avg + 10 is the same as above avg + 10
+        _, iris_frame = cv2.threshold(eye_frame_gray, threshold, 255, cv2.THRESH_BINARY_INV)
+        if threshold < 255:
+            # black pixels are outside the eye, image_processing turns them white before thresholding
+            iris_frame[eye_frame_gray == 0] = 0
+        return iris_frame
+
+    def detect_iris_fast(self, eye_frame, eye_closed=False):
+        """Same centroid as detect_iris, from the external contours only and without sorting them"""
+        if eye_closed or eye_frame is None or eye_frame.size == 0:
+            return
+        self.iris_frame = self.image_processing_fast(eye_frame)
+        if self.iris_frame is None:
+            return
+
+        contours, _ = cv2.findContours(self.iris_frame, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2:]
+        if len(contours) == 0:
+            return
+        moments = cv2.moments(max(contours, key=cv2.contourArea))
+        if moments['m00'] == 0:
+            return
+        self.x = int(moments['m10'] / moments['m00'])
+        self.y = int(moments['m01'] / moments['m00'])
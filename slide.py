@@ -1,24 +1,79 @@
 import pandas as pd
 import numpy as np
 
+from log_io import read_log
+from fixation import central_difference_velocity, fixation_runs
+
+# Mind wandering thresholds shared by slide_report and the Slide methods
+ERRATIC_RATIO_THRESHOLD = 0.3
+BLINK_RATE_THRESHOLD = 0.5
+AVG_BLINK_DURATION_LOWER_BOUND = 0.1
+AVG_BLINK_DURATION_UPPER_BOUND = 0.4
+
+
+def erratic_fixations(avg_velocity, velocity_threshold):
+    """
+        Marks the fixations whose average velocity is over 1.5 times the velocity threshold
+    """
+    return np.asarray(avg_velocity) > velocity_threshold * 1.5
+
+
+def blink_rate(blink_count, slide_period):
+    slide_duration = slide_period[1] - slide_period[0]
+    return blink_count / slide_duration if slide_duration != 0 else 0
+
+
+def blink_flags(rate, avg_blink_duration, blink_rate_threshold=BLINK_RATE_THRESHOLD,
+                avg_blink_duration_threshold_lower_bound=AVG_BLINK_DURATION_LOWER_BOUND,
+                avg_blink_duration_threshold_upper_bound=AVG_BLINK_DURATION_UPPER_BOUND):
+    """
+        Returns rate_flag, duration_flag
+    """
+    rate_flag = rate > blink_rate_threshold
+    duration_flag = (
+        avg_blink_duration < avg_blink_duration_threshold_lower_bound or
+        avg_blink_duration > avg_blink_duration_threshold_upper_bound
+    )
+    return rate_flag, duration_flag
+
+
 class Slides:
     def __init__(self, blink_df_path, gaze_df_path, user_inputs_path, word_count, velocity_threshold):
-        self.blink_df = pd.read_csv(blink_df_path)
-        self.gaze_df = pd.read_csv(gaze_df_path)
+        self.blink_df = read_log(blink_df_path)
+        self.gaze_df = read_log(gaze_df_path)
         self.user_inputs = pd.read_csv(user_inputs_path)
         self.word_count = word_count
         self.velocity_threshold = velocity_threshold
-        self.slides = self.get_slides()
-       
+        self._slides = None
+
+    @property
+    def slides(self):
+        # the per-slide objects are only built when asked for, the report doesn't need them
+        if self._slides is None:
+            self._slides = self.get_slides()
+        return self._slides
 
     def get_slides(self):
+        # every log is grouped by slide once instead of masked once per slide
+        blink_rows = self.rows_by_slide(self.blink_df)
+        gaze_rows = self.rows_by_slide(self.gaze_df)
+        transitions = Slide.transition_times(self.user_inputs)
+
         slides = []
         for slide in self.number_of_slides(self.user_inputs):
-            blink_df = self.blink_df[self.blink_df['slide'] == slide]
-            gaze_df = self.gaze_df[self.gaze_df['slide'] == slide]
+            blink_df = self.blink_df.iloc[blink_rows.get(slide, [])]
+            gaze_df = self.gaze_df.iloc[gaze_rows.get(slide, [])]
+            slide_period = Slide.period_from_transitions(transitions, slide)
 
-            slides.append(Slide(slide,blink_df, gaze_df, self.user_inputs, self.word_count[slide], self.velocity_threshold))
+            slides.append(Slide(slide,blink_df, gaze_df, self.user_inputs, self.word_count[slide], self.velocity_threshold, slide_period))
         return slides
+
+    @staticmethod
+    def rows_by_slide(df):
+        """
+            Returns {slide: positions of the rows of that slide}, rows keep their original order
+        """
+        return df.groupby('slide', sort=False).indices
     
     @staticmethod
     def number_of_slides(df):
@@ -27,28 +82,76 @@ class Slides:
         return df['slide'].unique()
     
     def mind_wandering_report(self):
-        report_data = []
-        for slide in self.slides:
-            mw_flag, metrics = slide.detect_mind_wandering_overall()
-            report_data.append({
-                'slide': slide.slide_number,
-                'time_period': slide.slide_period,
-                'mind_wandering': mw_flag,
-                'velocity_flag': metrics['velocity_metrics'],
-                'blink_rate_flag': metrics['blink_rate_metrics'],
-                'blink_duration_flag': metrics['blink_duration_metrics'],
-            })
-            #print(metrics)
-        
-        report_df = pd.DataFrame(report_data)
-        return report_df
+        return slide_report(self.blink_df, self.gaze_df, self.user_inputs, self.velocity_threshold)
+
+
+def slide_report(blink_df, gaze_df, user_inputs, velocity_threshold,
+                 erratic_ratio_threshold=ERRATIC_RATIO_THRESHOLD, blink_rate_threshold=BLINK_RATE_THRESHOLD,
+                 avg_blink_duration_threshold_lower_bound=AVG_BLINK_DURATION_LOWER_BOUND,
+                 avg_blink_duration_threshold_upper_bound=AVG_BLINK_DURATION_UPPER_BOUND):
+    """
+        Builds the mind wandering report of every slide in one grouped pass over the logs.
+        Gives the same flags as Slide.detect_mind_wandering_overall without building Slide objects,
+        so it can be run on many sessions at once.
+    """
+    slide_numbers = Slides.number_of_slides(user_inputs)
+    transitions = Slide.transition_times(user_inputs)
+
+    # blink count and average duration for all slides at once
+    blink_stats = blink_df.groupby(blink_df['slide'].astype(float))['duration'].agg(['size', 'mean'])
+    blink_count = blink_stats['size'].reindex(slide_numbers.astype(float), fill_value=0).to_numpy()
+    avg_blink_duration = blink_stats['mean'].reindex(slide_numbers.astype(float)).to_numpy()
+
+    # gaze samples sorted by slide then time, so every slide is one contiguous block,
+    # samples with the same time keep their log order
+    gaze_slide = gaze_df['slide'].to_numpy(dtype=float)
+    gaze_time = gaze_df['start_time'].to_numpy(dtype=float)
+    order = np.lexsort((np.arange(len(gaze_time)), gaze_time, gaze_slide))
+    gaze_slide = gaze_slide[order]
+    gaze_time = gaze_time[order]
+    x_pos = ((gaze_df['left_eye_x'].to_numpy(dtype=float) + gaze_df['right_eye_x'].to_numpy(dtype=float)) / 2.0)[order]
+    block_starts = np.searchsorted(gaze_slide, slide_numbers.astype(float), side='left')
+    block_ends = np.searchsorted(gaze_slide, slide_numbers.astype(float), side='right')
+
+    report_data = []
+    for i, slide in enumerate(slide_numbers):
+        slide_period = Slide.period_from_transitions(transitions, slide)
+
+        block = slice(block_starts[i], block_ends[i])
+        velocity = central_difference_velocity(x_pos[block], gaze_time[block])
+        fixation_duration, avg_velocity = fixation_runs(gaze_time[block], velocity, velocity_threshold)
+        if len(fixation_duration) == 0:
+            velocity_flag = False
+        else:
+            erratic_ratio = np.sum(erratic_fixations(avg_velocity, velocity_threshold)) / len(fixation_duration)
+            velocity_flag = bool(erratic_ratio > erratic_ratio_threshold)
+
+        rate_flag, duration_flag = blink_flags(blink_rate(blink_count[i], slide_period), avg_blink_duration[i],
+                                               blink_rate_threshold, avg_blink_duration_threshold_lower_bound,
+                                               avg_blink_duration_threshold_upper_bound)
+        blink_rate_flag = bool(rate_flag)
+        blink_duration_flag = bool(duration_flag)
+
+        report_data.append({
+            'slide': slide,
+            'time_period': slide_period,
+            'mind_wandering': velocity_flag or blink_rate_flag or blink_duration_flag,
+            'velocity_flag': velocity_flag,
+            'blink_rate_flag': blink_rate_flag,
+            'blink_duration_flag': blink_duration_flag,
+        })
+
+    report_df = pd.DataFrame(report_data)
+    return report_df
 
 class Slide:
-    def __init__(self, slide_number, blink_df, gaze_df, user_inputs_path, word_count, velocity):
+    def __init__(self, slide_number, blink_df, gaze_df, user_inputs_path, word_count, velocity, slide_period=None):
         self.slide_number = slide_number
         self.blink_df = blink_df
         self.gaze_df = gaze_df
-        self.slide_period = self.slide_times(user_inputs_path, self.slide_number)
+        if slide_period is None:
+            slide_period = self.slide_times(user_inputs_path, self.slide_number)
+        self.slide_period = slide_period
         self.word_count = word_count
         self.estimeated_reading_time = word_count / (self.slide_period[1] - self.slide_period[0])
         self.velocity_threshold = velocity
@@ -56,9 +159,15 @@ class Slide:
 
     @staticmethod
     def slide_times(user_inputs_df, slide_number):
+        return Slide.period_from_transitions(Slide.transition_times(user_inputs_df), slide_number)
+
+    @staticmethod
+    def transition_times(user_inputs_df):
         slide_df = user_inputs_df[user_inputs_df['action'] == 'slide_transition']
-        slide_periods = slide_df['time'].values
+        return slide_df['time'].values
 
+    @staticmethod
+    def period_from_transitions(slide_periods, slide_number):
         if slide_number == 0:
             return 0, slide_periods[0]
         elif slide_number == len(slide_periods):
@@ -67,9 +176,7 @@ class Slide:
             return slide_periods[slide_number - 1], slide_periods[slide_number]
         
     def get_blink_rate(self):
-        number_of_blinks = len(self.blink_df)
-        slide_duration = self.slide_period[1] - self.slide_period[0]
-        return number_of_blinks/slide_duration if slide_duration != 0 else 0
+        return blink_rate(len(self.blink_df), self.slide_period)
     
     def get_avg_blink_duration(self):
         print(self.blink_df)
@@ -86,86 +193,50 @@ class Slide:
 
         gaze_df['time'] = gaze_df['start_time']
 
-        gaze_df = gaze_df.sort_values(by = 'time').reset_index(drop=True)
+        # stable, so samples with the same time keep their log order like in slide_report
+        gaze_df = gaze_df.sort_values(by = 'time', kind='stable').reset_index(drop=True)
 
         x_positions = gaze_df['x_pos'].values
         time = gaze_df['time'].values
 
-        velocity = np.zeros(len(x_positions))
-        # Central difference for interior points
-        for i in range(1, len(x_positions) - 1):
-            dt = time[i+1] - time[i-1]
-            velocity[i] = (x_positions[i+1] - x_positions[i-1]) / dt if dt != 0 else 0
-        
-        # Handle the boundaries (e.g., using forward/backward difference)
-        if len(velocity) > 1:
-            velocity[0] = velocity[1]
-            velocity[-1] = velocity[-2]
+        velocity = central_difference_velocity(x_positions, time)
 
-        gaze_df['velocity'] = velocity
         # Compute fixation
-        gaze_df['fixation'] = np.abs(gaze_df['velocity']) < self.velocity_threshold
-
-        fixation_duration = []
-        avg_velocity = []
-        start_idx = None
-
-        for i, is_fix in enumerate(gaze_df['fixation']):
-            if is_fix and start_idx is None:
-                start_idx = i
-            elif not is_fix and start_idx is not None:
-                duration = gaze_df.loc[i - 1, 'time'] - gaze_df.loc[start_idx, 'time']
-                fixation_duration.append(duration)
-                
-                avg_v = gaze_df.loc[start_idx:i, 'velocity'].mean()
-                avg_velocity.append(avg_v)
-                
-                start_idx = None
-        if start_idx is not None:
-            duration = gaze_df.loc[i, 'time'] - gaze_df.loc[start_idx, 'time']
-            fixation_duration.append(duration)
-            avg_v = gaze_df.loc[start_idx:len(gaze_df), 'velocity'].mean()
-            avg_velocity.append(avg_v)
-        
-        return np.array(fixation_duration), np.array(avg_velocity)
+        return fixation_runs(time, velocity, self.velocity_threshold)
     
-    def detect_mind_wandering_velocity(self, erratic_ratio_threshold=0.3):
+    def detect_mind_wandering_velocity(self, erratic_ratio_threshold=ERRATIC_RATIO_THRESHOLD):
         fixation_duration, avg_velocity = self.extract_fixation_features()
-        
-        erratic_velocity_threshold = self.velocity_threshold * 1.5
 
         if len(fixation_duration) == 0:
             return False, {}
-        erratic_fixations = avg_velocity > erratic_velocity_threshold
-        erratic_ratio = np.sum(erratic_fixations) / len(fixation_duration)
+        erratic = erratic_fixations(avg_velocity, self.velocity_threshold)
+        erratic_ratio = np.sum(erratic) / len(fixation_duration)
 
         mind_wandering = erratic_ratio > erratic_ratio_threshold
 
         metrics = {
         'total_fixations': len(avg_velocity),
-        'erratic_fixations': int(np.sum(erratic_fixations)),
+        'erratic_fixations': int(np.sum(erratic)),
         'erratic_ratio': erratic_ratio,
         'avg_fixation_velocities': avg_velocity     
         }
 
         return mind_wandering, metrics
     
-    def detect_mind_wandering_blink(self, blink_rate_threshold=0.5, 
-                                 avg_blink_duration_threshold_lower_bound=0.1,
-                                 avg_blink_duration_threshold_upper_bound=0.4):
-        blink_rate = self.get_blink_rate()
+    def detect_mind_wandering_blink(self, blink_rate_threshold=BLINK_RATE_THRESHOLD,
+                                 avg_blink_duration_threshold_lower_bound=AVG_BLINK_DURATION_LOWER_BOUND,
+                                 avg_blink_duration_threshold_upper_bound=AVG_BLINK_DURATION_UPPER_BOUND):
+        rate = self.get_blink_rate()
         avg_blink_duration = self.get_avg_blink_duration()
-        print(blink_rate, avg_blink_duration)
+        print(rate, avg_blink_duration)
 
         # Separate flags:
-        rate_flag = blink_rate > blink_rate_threshold
-        duration_flag = (
-            avg_blink_duration < avg_blink_duration_threshold_lower_bound or 
-            avg_blink_duration > avg_blink_duration_threshold_upper_bound
-        )
+        rate_flag, duration_flag = blink_flags(rate, avg_blink_duration, blink_rate_threshold,
+                                               avg_blink_duration_threshold_lower_bound,
+                                               avg_blink_duration_threshold_upper_bound)
 
         blink_metrics = {
-            'blink_rate': blink_rate,
+            'blink_rate': rate,
             'avg_blink_duration': avg_blink_duration,
             'rate_flag': rate_flag,
             'duration_flag': duration_flag